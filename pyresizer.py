@@ -1,80 +1,2716 @@
 #!/usr/bin/env python3
+# Tool is built and installed as single file (see README), so it is one module
+# pylint: disable=too-many-lines
 
 import argparse
+import json
 import platform
 import sys
+import time
+from errno import EXDEV as errno_EXDEV
+from functools import partial as functools_partial
+from hashlib import sha256 as hashlib_sha256
+from io import BytesIO as io_BytesIO
+from math import ceil as math_ceil
+from math import floor as math_floor
+from os import cpu_count as os_cpu_count
+from os import environ as os_environ
+from os import fsdecode as os_fsdecode
+from os import fstat as os_fstat
+from os import fsync as os_fsync
+from os import link as os_link
 from os import listdir as os_listdir
+from os import makedirs as os_makedirs
 from os import mkdir as os_mkdir
+from os import pardir as os_pardir
 from os import path as os_path
 from os import remove as os_remove
-from re import MULTILINE as re_MULTILINE
-from re import compile as re_compile
+from os import replace as os_replace
+from os import scandir as os_scandir
+from os import sep as os_sep
+from os import stat as os_stat
+from os import utime as os_utime
+from queue import Queue as queue_Queue
 from shutil import copy2 as shutil_copy2
+from shutil import copystat as shutil_copystat
 from shutil import rmtree as shutil_rmtree
+from threading import BoundedSemaphore as threading_BoundedSemaphore
+from threading import Condition as threading_Condition
+from threading import Event as threading_Event
+from threading import Lock as threading_Lock
+from threading import Thread as threading_Thread
 
-from PIL.Image import Resampling as pil_Resampling
-from PIL.Image import open as pil_open
+try:
+    from fcntl import ioctl as fcntl_ioctl
+except ImportError:
+    # Not available on Windows, copy-on-write clones are not made there
+    fcntl_ioctl = None  # type: ignore[assignment]
 
-if platform.system() == "Windows":
-    import winreg
+# Linux ioctl request cloning file content with copy-on-write (Btrfs, XFS, ...)
+FICLONE = 0x40049409
+# Images with larger decoded bitmap are not loaded into memory at once
+LARGE_IMAGE_BYTES = 256 * 1024**2
+# Size of part of large image decoded at once
+STRIP_BYTES = 16 * 1024**2
+# Formats whose animations are kept, other multi-frame images (e.g. MPO photos
+# of cameras) are resized as their first frame
+ANIMATED_FORMATS = ("GIF", "PNG", "WEBP")
+# Images whose perceptual hashes differ in at most so many of 64 bits are
+# considered the same (e.g. photo saved again with other quality)
+DHASH_DISTANCE = 4
+# Default size of cache of resized images shared by runs
+CACHE_BYTES = 1024**3
+
+# Modules not needed by every run (e.g. Pillow for --help, -i and -u) are
+# imported on first use, so startup of frozen executable is shorter
+
+
+def _pil():
+    """PIL.Image module"""
+
+    import PIL.Image
+
+    return PIL.Image
+
+
+def _process_pool(jobs):
+    """Pool of worker processes which are never forked from current process
+
+    Worker forked while other thread holds a lock (e.g. of import of Pillow
+    plugin) would wait for it forever. Fork server is started without
+    threads, workers are spawned where it is not available.
+    """
+
+    from concurrent.futures import ProcessPoolExecutor as cf_ProcessPoolExecutor
+    from multiprocessing import get_all_start_methods as mp_get_all_start_methods
+    from multiprocessing import get_context as mp_get_context
+
+    method = "forkserver" if "forkserver" in mp_get_all_start_methods() else "spawn"
+    return cf_ProcessPoolExecutor(max_workers=jobs, mp_context=mp_get_context(method))
+
+
+def pil_open(fp):
+    return _pil().open(fp)
+
+
+def pil_new(mode, size):
+    return _pil().new(mode, size)
+
+
+def pil_registered_extensions():
+    return _pil().registered_extensions()
+
+
+def _fit_size(size, box):
+    """Size of image shrunk to fit box keeping its aspect ratio, as by thumbnail()"""
+
+    width, height = math_floor(box[0]), math_floor(box[1])
+    aspect = size[0] / size[1]
+    if width / height >= aspect:
+        width = max(
+            min(
+                math_floor(height * aspect),
+                math_ceil(height * aspect),
+                key=lambda n: abs(aspect - n / height),
+            ),
+            1,
+        )
+    else:
+        height = max(
+            min(
+                math_floor(width / aspect),
+                math_ceil(width / aspect),
+                key=lambda n: 0 if n == 0 else abs(aspect - width / n),
+            ),
+            1,
+        )
+    return width, height
+
+
+class PillowEngine:
+    """Resampling of images by Pillow, or by its drop-in replacement (Pillow-SIMD)
+
+    Engines are made from settings in worker processes, see resample_engine().
+    """
+
+    name = "pillow"
+    # Filters from the sharpest and slowest one
+    FILTERS: tuple[str, ...] = ("lanczos", "bicubic", "hamming", "bilinear", "box")
+
+    def __init__(self, resample_filter="lanczos", reducing_gap=None):
+        self.resample_filter = resample_filter
+        # Image is reduced by integer factor first, so that it stays reducing_gap
+        # times larger than target, then resampled. Faster with result close to
+        # resampling at once. Pillow defaults are used if not set
+        self.reducing_gap = reducing_gap
+
+    @staticmethod
+    def available():
+        return True
+
+    @property
+    def _filter(self):
+        return _pil().Resampling[self.resample_filter.upper()]
+
+    def resize(self, im, size):
+        return im.resize(size, self._filter, reducing_gap=self.reducing_gap)
+
+    def thumbnail(self, im, box):
+        """Shrink image to fit box keeping its aspect ratio, return shrunk image
+
+        JPEG images are scaled during decoding as much as reducing gap allows.
+        """
+
+        if self.reducing_gap is None:
+            im.thumbnail(box, self._filter)
+        else:
+            im.thumbnail(box, self._filter, reducing_gap=self.reducing_gap)
+        return im
+
+
+class OpenCVEngine(PillowEngine):
+    """Resampling by OpenCV, used if opencv-python and NumPy are installed
+
+    Its filters are not widened when shrinking, so image is first reduced by
+    area averaging to reducing gap times target size, otherwise it would alias.
+    """
+
+    name = "opencv"
+    FILTERS = ("lanczos", "bicubic", "bilinear", "box")
+
+    @staticmethod
+    def available():
+        from importlib.util import find_spec
+
+        return all(find_spec(module) for module in ("cv2", "numpy"))
+
+    def resize(self, im, size):
+        import cv2
+        import numpy
+
+        if im.mode not in ("L", "RGB", "RGBA"):
+            im = im.convert("RGBA" if im.has_transparency_data else "RGB")
+        pixels = numpy.asarray(im)
+        if self.resample_filter == "box":
+            return _pil().fromarray(
+                cv2.resize(pixels, size, interpolation=cv2.INTER_AREA)
+            )
+        gap = 2.0 if self.reducing_gap is None else self.reducing_gap
+        reduced = (round(size[0] * gap), round(size[1] * gap))
+        if reduced[0] < im.size[0]:
+            pixels = cv2.resize(pixels, reduced, interpolation=cv2.INTER_AREA)
+        interpolation = {
+            "lanczos": cv2.INTER_LANCZOS4,
+            "bicubic": cv2.INTER_CUBIC,
+            "bilinear": cv2.INTER_LINEAR,
+        }[self.resample_filter]
+        return _pil().fromarray(cv2.resize(pixels, size, interpolation=interpolation))
+
+    def thumbnail(self, im, box):
+        size = _fit_size(im.size, box)
+        if size[0] >= im.size[0]:
+            return im
+        gap = 2.0 if self.reducing_gap is None else self.reducing_gap
+        im.draft(None, (int(size[0] * gap), int(size[1] * gap)))
+        return self.resize(im, size)
+
+
+RESAMPLE_ENGINES = {engine.name: engine for engine in (PillowEngine, OpenCVEngine)}
+
+
+def resample_engine(resampling=None):
+    """Engine made from settings, e.g. {"engine": "pillow", "filter": "box",
+    "reducing_gap": 3.0}. Missing ones are defaults (Pillow with LANCZOS filter).
+    """
+
+    resampling = resampling or {}
+    return RESAMPLE_ENGINES[resampling.get("engine", "pillow")](
+        resampling.get("filter", "lanczos"), resampling.get("reducing_gap")
+    )
+
+
+def _shrink(im, new_width, fast=False, engine=None):
+    """Shrink opened image to new width, return resized image and source size"""
+
+    im_width, im_height = im.size
+    new_height = new_width * im_height / im_width
+    img_dims = (new_width, new_height)
+    if fast:
+        # JPEG decoder scales image by 1/2, 1/4 or 1/8 during decoding, only as
+        # much as allowed to keep it not smaller than target. Other formats ignore it
+        im.draft(im.mode, (new_width, math_ceil(new_height)))
+    if im.mode == "P":
+        # Palette images would be resampled with nearest neighbour only, so
+        # colours are interpolated in RGB and reduced to palette during encoding
+        im = im.convert("RGBA" if im.has_transparency_data else "RGB")
+    im = (engine or PillowEngine()).thumbnail(im, img_dims)
+    return im, (im_width, im_height)
+
+
+def _open_resized(img, new_width, fast=False):
+    """Open image and shrink it to new width, return resized image and source size"""
+
+    return _shrink(pil_open(img), new_width, fast)
+
+
+def _file_hash(img):
+    """SHA-256 of file content, read in chunks to keep memory usage low"""
+
+    digest = hashlib_sha256()
+    with open(img, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _src_hash(data):
+    """SHA-256 of source image, given as data or as file name of large image"""
+
+    if isinstance(data, str):
+        return _file_hash(data)
+    return hashlib_sha256(data).hexdigest()
+
+
+def _reflink(src, dst):
+    """Clone file without copying its data, return False if it is not supported"""
+
+    if platform.system() != "Linux" or fcntl_ioctl is None:
+        return False
+    with open(src, "rb") as src_f, open(dst, "wb") as dst_f:
+        try:
+            fcntl_ioctl(dst_f.fileno(), FICLONE, src_f.fileno())
+            cloned = True
+        except OSError:
+            cloned = False
+    if not cloned:
+        os_remove(dst)
+        return False
+    shutil_copystat(src, dst)
+    return True
+
+
+def _clone_file(src, dst, hardlink=False):
+    """Make copy of file sharing its data if possible, target is replaced atomically
+
+    Copy-on-write clone is tried first, then hard link if it is allowed, then
+    full copy. Returns stat result of target.
+    """
+
+    folder, name = os_path.split(dst)
+    tmp_img = os_path.join(folder, f".{name}.pyresizer-tmp")
+    try:
+        cloned = _reflink(src, tmp_img)
+        if not cloned and hardlink:
+            try:
+                os_link(src, tmp_img)
+                cloned = True
+            except OSError:
+                pass
+        if not cloned:
+            shutil_copy2(src, tmp_img)
+        os_replace(tmp_img, dst)
+    except BaseException:
+        if os_path.exists(tmp_img):
+            os_remove(tmp_img)
+        raise
+    return os_stat(dst)
+
+
+def _dhash(data):
+    """Perceptual hash of encoded image, None for animations and broken images
+
+    Image is decoded at reduced size where format allows it (JPEG by 1/8) and
+    shrunk to 9x8 grey pixels, each of 64 bits tells whether pixel is brighter
+    than its right neighbour. Hashes of similar images differ in few bits.
+    """
+
+    try:
+        with pil_open(io_BytesIO(data)) as im:
+            if getattr(im, "is_animated", False):
+                return None
+            im.draft("L", (9, 8))
+            pixels = im.convert("L").resize((9, 8), _pil().Resampling.BOX).tobytes()
+    except OSError:
+        return None
+    fingerprint = 0
+    for row in range(8):
+        for col in range(row * 9, row * 9 + 8):
+            fingerprint = fingerprint << 1 | (pixels[col] > pixels[col + 1])
+    return fingerprint
+
+
+def _raw_tile(im):
+    """Offset and decoder arguments of image stored as single raw tile, None otherwise"""
+
+    if len(im.tile) != 1 or im.tile[0][0] != "raw":
+        return None
+    _, extents, offset, args = im.tile[0]
+    if extents != (0, 0, *im.size) or len(args) != 3 or args[1] <= 0:
+        return None
+    return offset, args
+
+
+class FingerprintIndex:
+    """Perceptual hashes searchable by Hamming distance, without comparing all pairs
+
+    Hashes are split into distance + 1 bands of bits. Hashes differing in at
+    most distance bits have at least one band equal, so only hashes sharing
+    band with searched one are compared.
+    """
+
+    def __init__(self, distance=DHASH_DISTANCE, bits=64):
+        self.distance = distance
+        # (shift, mask) of each band
+        self._bands = []
+        shift = 0
+        for band in range(distance + 1):
+            width = bits // (distance + 1) + (band < bits % (distance + 1))
+            self._bands.append((shift, (1 << width) - 1))
+            shift += width
+        # (band number, its bits): [(hash, item), ...]
+        self._buckets = {}
+
+    def find(self, fingerprint):
+        """Return item of hash not farther than distance, None if there is none"""
+
+        for band, (shift, mask) in enumerate(self._bands):
+            for other, item in self._buckets.get(
+                (band, fingerprint >> shift & mask), ()
+            ):
+                if bin(fingerprint ^ other).count("1") <= self.distance:
+                    return item
+        return None
+
+    def add(self, fingerprint, item):
+        for band, (shift, mask) in enumerate(self._bands):
+            self._buckets.setdefault((band, fingerprint >> shift & mask), []).append(
+                (fingerprint, item)
+            )
+
+
+def _probe_img(img):
+    """Read size, reduced decoding and frames of image from file, pixels are not decoded
+
+    Reduced decoding is "strips" for images read strip by strip (see
+    _reduce_strips()), "draft" for JPEG images scaled during decoding, None
+    for images decoded at once. Frames are counted only for animations which
+    are kept, 1 for others. Returns None if image cannot be opened.
+    """
+
+    try:
+        im = pil_open(img)
+    except OSError:
+        return None
+    try:
+        reduction = None
+        frames = 1
+        if _raw_tile(im) is not None:
+            reduction = "strips"
+        elif im.format == "JPEG":
+            reduction = "draft"
+        elif getattr(im, "is_animated", False) and im.format in ANIMATED_FORMATS:
+            frames = im.n_frames
+        return im.size, reduction, frames
+    finally:
+        im.close()
+
+
+def _draft_scale(size, new_width):
+    """Scale of JPEG image decoded for new width by draft(), 1, 2, 4 or 8"""
+
+    scale = size[0] // new_width
+    scale = min(scale, size[1] // max(1, math_ceil(new_width * size[1] / size[0])))
+    return next(factor for factor in (8, 4, 2, 1) if scale >= factor)
+
+
+def _reduce_strips(im, img, factor):
+    """Reduce uncompressed image by integer factor, reading it strip by strip
+
+    Only images stored as single raw tile (e.g. BMP) are supported, None is
+    returned for others. Peak memory usage is reduced image and one strip,
+    instead of whole decoded bitmap.
+    """
+
+    raw_tile = _raw_tile(im)
+    if raw_tile is None:
+        return None
+    offset, args = raw_tile
+    width, height = im.size
+    stride, ystep = args[1], args[2]
+    # Strip height is multiple of factor, so reduced boxes never cross strips
+    rows = max(factor, STRIP_BYTES // stride // factor * factor)
+    reduced = None
+    for top in range(0, height, rows):
+        bottom = min(top + rows, height)
+        # Bottom-up images store last row first
+        start = offset + (top if ystep > 0 else height - bottom) * stride
+        strip = pil_open(img)
+        # Header is reused, only part of pixel data is decoded
+        strip._size = (width, bottom - top)  # pylint: disable=protected-access
+        strip.tile = [("raw", (0, 0, width, bottom - top), start, args)]
+        if strip.mode == "P":
+            strip = strip.convert("RGBA" if strip.has_transparency_data else "RGB")
+        part = strip.reduce(factor)
+        if reduced is None:
+            reduced = pil_new(
+                part.mode, (math_ceil(width / factor), math_ceil(height / factor))
+            )
+        reduced.paste(part, (0, top // factor))
+    return reduced
+
+
+def _shrink_large(im, img, new_width, engine=None):
+    """Shrink image opened from file with memory usage depending on output size
+
+    Uncompressed images are reduced strip by strip, JPEG images are scaled
+    during decoding. Other formats are decoded at once.
+    """
+
+    im_width, im_height = im.size
+    # Same reducing gap as in thumbnail(), quality is not affected
+    factor = im_width // (new_width * 2)
+    reduced = _reduce_strips(im, img, factor) if factor > 1 else None
+    if reduced is None:
+        return _shrink(im, new_width, True, engine)
+    # Size is computed from source, aspect of reduced image is affected by
+    # rounding of its edges
+    new_size = (new_width, max(1, round(new_width * im_height / im_width)))
+    reduced = (engine or PillowEngine()).resize(reduced, new_size)
+    return reduced, (im_width, im_height)
+
+
+def _quantize(frame):
+    """Reduce frame to palette like GIF encoder does, transparency is kept"""
+
+    im = frame.convert("P", palette=_pil().Palette.ADAPTIVE)
+    if im.palette.mode == "RGBA":
+        for rgba, index in im.palette.colors.items():
+            if rgba[3] == 0:
+                im.info["transparency"] = index
+                break
+    return im
+
+
+def _shrink_frame(frame, widths, src_dims, quantize=False, engine=None):
+    """Shrink frame of animation to each of widths in cascade, return list of frames
+
+    Sizes are computed from source, so all frames of animation get the same ones.
+    """
+
+    frame = frame.convert("RGBA" if frame.has_transparency_data else "RGB")
+    frames = []
+    for width in widths:
+        if frame.size[0] > width:
+            new_size = (width, max(1, round(width * src_dims[1] / src_dims[0])))
+            frame = (engine or PillowEngine()).resize(frame, new_size)
+        frames.append(_quantize(frame) if quantize else frame)
+    return frames
+
+
+def _resize_frames(
+    im, widths, img_format, save_options=None, frame_jobs=1, engine=None
+):
+    """Resize all frames of animation, return (encoded image, size) pairs and encode time
+
+    Frames are decoded in order, as each is drawn over the previous one, and
+    shrunk in threads meanwhile, Pillow releases GIL while resampling and
+    quantizing. Only few decoded frames are kept in memory at once. Durations,
+    loop count and GIF disposal methods are kept.
+    """
+
+    from collections import deque as collections_deque
+    from concurrent.futures import ThreadPoolExecutor as cf_ThreadPoolExecutor
+
+    shrink = functools_partial(
+        _shrink_frame,
+        widths=widths,
+        src_dims=im.size,
+        quantize=img_format == "GIF",
+        engine=engine,
+    )
+    frames = []
+    durations = []
+    disposals = []
+    with cf_ThreadPoolExecutor(max_workers=frame_jobs) as executor:
+        futures = collections_deque()
+        for index in range(im.n_frames):
+            im.seek(index)
+            # Loaded by copying, WebP frame info is read only then
+            frame = im.copy()
+            durations.append(im.info.get("duration", 0))
+            disposals.append(getattr(im, "disposal_method", 0))
+            futures.append(executor.submit(shrink, frame))
+            if len(futures) >= frame_jobs * 2:
+                frames.append(futures.popleft().result())
+        while futures:
+            frames.append(futures.popleft().result())
+    params = {"save_all": True, "duration": durations}
+    if im.info.get("loop") is not None:
+        params["loop"] = im.info["loop"]
+    if img_format == "GIF" and im.format == "GIF":
+        params["disposal"] = disposals
+    params.update((save_options or {}).get(img_format, {}))
+    start = time.perf_counter()
+    outputs = []
+    for index in range(len(widths)):
+        first, *rest = [sizes[index] for sizes in frames]
+        out = io_BytesIO()
+        first.save(out, format=img_format, append_images=rest, **params)
+        outputs.append((out.getvalue(), list(first.size)))
+    return outputs, time.perf_counter() - start
+
+
+def _read_file(img):
+
+    with open(img, "rb") as f:
+        return f.read()
+
+
+def _write_atomic(data, img):
+    """Write file to temporary file in the same folder and rename it over target
+
+    Target is never left truncated, it contains either old or new content,
+    also after power loss. Returns stat result of written file.
+    """
+
+    folder, name = os_path.split(img)
+    # Hidden name without image extension, so it is never picked up by scanner
+    tmp_img = os_path.join(folder, f".{name}.pyresizer-tmp")
+    try:
+        with open(tmp_img, "wb") as f:
+            f.write(data)
+            f.flush()
+            # Data is on disk before rename, which may be persisted first
+            os_fsync(f.fileno())
+            img_stat = os_fstat(f.fileno())
+        os_replace(tmp_img, img)
+    except BaseException:
+        if os_path.exists(tmp_img):
+            os_remove(tmp_img)
+        raise
+    return img_stat
+
+
+def _encoder_options(
+    quality=None,
+    optimize=False,
+    progressive=False,
+    subsampling=None,
+    compress_level=None,
+):
+    """Map encoder settings to Pillow save() parameters of each output format
+
+    Settings not given are left out, so Pillow defaults are used. Empty if all
+    settings are default.
+    """
+
+    options = {
+        "JPEG": {
+            "quality": quality,
+            "optimize": optimize or None,
+            "progressive": progressive or None,
+            "subsampling": subsampling,
+        },
+        "PNG": {"optimize": optimize or None, "compress_level": compress_level},
+        "WEBP": {"quality": quality},
+        "AVIF": {"quality": quality},
+    }
+    options = {
+        img_format: {key: value for key, value in params.items() if value is not None}
+        for img_format, params in options.items()
+    }
+    return {img_format: params for img_format, params in options.items() if params}
+
+
+def _encode(im, img_format, save_options=None, palette=False):
+    """Encode image with settings of its format, return bytes
+
+    Palette of source image is restored for all formats storing palettes.
+    """
+
+    if palette and img_format == "GIF":
+        im = _quantize(im)
+    elif palette and img_format in ("BMP", "PNG"):
+        im = im.quantize(256, _pil().Quantize.FASTOCTREE)
+    elif img_format in ("WEBP", "AVIF") and im.mode not in ("RGB", "RGBA"):
+        im = im.convert("RGBA" if im.has_transparency_data else "RGB")
+    out = io_BytesIO()
+    im.save(out, format=img_format, **(save_options or {}).get(img_format, {}))
+    return out.getvalue()
+
+
+def _resize_data(
+    img,
+    data,
+    widths,
+    fast=False,
+    out_format=None,
+    save_options=None,
+    frame_jobs=1,
+    resampling=None,
+    src_hash=None,
+):
+    """Decode, resize and encode image; module-level to be usable by worker processes
+
+    Image is decoded once and shrunk to each of widths in cascade, largest
+    first, each next size is made from the previous one. Output format is
+    chosen by image name (or kept if there is no name), unless other format is
+    requested. Large images are passed as file name instead of data and never
+    loaded at once. Returns list of (encoded image, size) pairs together with
+    manifest entry of source image, including timings of stages. Decoding and
+    resampling are timed together, as Pillow scales JPEG images while decoding.
+    All frames of animations are resized, in frame_jobs threads. Resampling
+    engine is made from settings, see resample_engine(). Source is hashed
+    unless its hash is given.
+    """
+
+    engine = resample_engine(resampling)
+    start = time.perf_counter()
+    if src_hash is None:
+        src_hash = _src_hash(data)
+    timings = {"hash_s": time.perf_counter() - start}
+    start = time.perf_counter()
+    if isinstance(data, str):
+        im = pil_open(data)
+    else:
+        im = pil_open(io_BytesIO(data))
+    img_format = out_format or im.format
+    if img and not out_format:
+        img_format = pil_registered_extensions()[os_path.splitext(img)[1].lower()]
+    if getattr(im, "is_animated", False) and im.format in ANIMATED_FORMATS:
+        src_dims = im.size
+        outputs, timings["encode_s"] = _resize_frames(
+            im, widths, img_format, save_options, frame_jobs, engine
+        )
+        timings["decode_resample_s"] = time.perf_counter() - start - timings["encode_s"]
+    else:
+        palette = im.mode == "P"
+        if isinstance(data, str):
+            im, src_dims = _shrink_large(im, data, widths[0], engine)
+        else:
+            im, src_dims = _shrink(im, widths[0], fast, engine)
+        outputs = []
+        timings["decode_resample_s"] = time.perf_counter() - start
+        timings["encode_s"] = 0.0
+        for index, width in enumerate(widths):
+            # First size is already made during opening
+            if index > 0 and im.size[0] > width:
+                start = time.perf_counter()
+                # Height rounded up, so that width is the limiting dimension
+                im = engine.thumbnail(
+                    im, (width, math_ceil(width * src_dims[1] / src_dims[0]))
+                )
+                timings["decode_resample_s"] += time.perf_counter() - start
+            start = time.perf_counter()
+            outputs.append(
+                (_encode(im, img_format, save_options, palette), list(im.size))
+            )
+            timings["encode_s"] += time.perf_counter() - start
+    return outputs, {
+        "src_hash": src_hash,
+        "src_dims": list(src_dims),
+        # Not stored in manifest, removed by writer stage
+        "timings": timings,
+    }
+
+
+def _read_src(src):
+    """Data of image given as bytes-like or binary file-like object"""
+
+    if hasattr(src, "read"):
+        return src.read()
+    return bytes(src)
+
+
+def _sorted_widths(width):
+    """Widths ordered for cascade, largest first, with their requested positions"""
+
+    widths = [width] if isinstance(width, int) else list(width)
+    order = sorted(range(len(widths)), key=lambda index: -widths[index])
+    return [widths[index] for index in order], order
+
+
+def _api_result(width, order, outputs):
+    """Encoded images of resize_image() in order of requested widths"""
+
+    if isinstance(width, int):
+        return outputs[0][0]
+    results = [None] * len(order)
+    for index, (data, _) in zip(order, outputs):
+        results[index] = data
+    return results
+
+
+def resize_image(
+    src,
+    width,
+    fast=False,
+    out_format=None,
+    save_options=None,
+    frame_jobs=1,
+    resampling=None,
+):
+    """Resize image kept in memory, return encoded image as bytes
+
+    Source is bytes-like or binary file-like object. If list of widths is
+    given, list of images in the same order is returned, all made from single
+    decoding. Format of source is kept unless other Pillow format (e.g.
+    "WEBP") is requested, save_options are as returned by _encoder_options().
+    Frames of animations are resized in frame_jobs threads, resampling is
+    as in resample_engine(). Nothing is written to disk or printed. Raises
+    IOError if image cannot be decoded.
+    """
+
+    widths, order = _sorted_widths(width)
+    outputs, _ = _resize_data(
+        None,
+        _read_src(src),
+        widths,
+        fast,
+        out_format,
+        save_options,
+        frame_jobs,
+        resampling,
+    )
+    return _api_result(width, order, outputs)
+
+
+def resize_images(
+    srcs,
+    width,
+    jobs=1,
+    fast=False,
+    out_format=None,
+    save_options=None,
+    resampling=None,
+):
+    """Resize images from iterable lazily, yield results of resize_image()
+
+    Results are yielded in order of sources. With more than one job images are
+    resized in worker processes, at most two per job are read ahead, so
+    iterable may be arbitrarily long.
+    """
+
+    widths, order = _sorted_widths(width)
+    args = (widths, fast, out_format, save_options, 1, resampling)
+    if jobs <= 1:
+        for src in srcs:
+            outputs, _ = _resize_data(None, _read_src(src), *args)
+            yield _api_result(width, order, outputs)
+        return
+    from collections import deque as collections_deque
+
+    with _process_pool(jobs) as executor:
+        futures = collections_deque()
+        for src in srcs:
+            futures.append(executor.submit(_resize_data, None, _read_src(src), *args))
+            if len(futures) >= jobs * 2:
+                yield _api_result(width, order, futures.popleft().result()[0])
+        while futures:
+            yield _api_result(width, order, futures.popleft().result()[0])
+
+
+class ImageScanner:
+    """Lazy, single pass listing of images in folder
+
+    Found entries are cached, so next iterations do not touch the file system
+    again, and iteration may start before the listing completes. In recursive
+    mode subfolders are walked depth-first, without caching, so memory usage
+    does not depend on number of files in the tree.
+    """
+
+    def __init__(
+        self, folder, img_formats, recursive=False, skip_dirs=(), skip_paths=()
+    ):
+        self.folder = folder
+        self.img_formats = tuple(img_formats)
+        self.recursive = recursive
+        # Folders skipped by name at any level, e.g. backup folders
+        self.skip_dirs = set(skip_dirs)
+        # Folders skipped by location, e.g. output folders inside scanned tree
+        self.skip_paths = {os_path.abspath(p) for p in skip_paths}
+        self._entries = None if recursive else []
+        self._scan = self._scan_folder()
+
+    def _scan_folder(self):
+
+        folders = [self.folder]
+        while folders:
+            with os_scandir(folders.pop()) as entries:
+                for entry in entries:
+                    if self.recursive and entry.is_dir(follow_symlinks=False):
+                        if entry.name not in self.skip_dirs and (
+                            os_path.abspath(entry.path) not in self.skip_paths
+                        ):
+                            folders.append(entry.path)
+                        continue
+                    # Real extension match, "foo.png.txt" is not an image
+                    ext = os_path.splitext(entry.name)[1].lower()
+                    if ext in self.img_formats and entry.is_file():
+                        yield entry
+
+    def __iter__(self):
+
+        if self._entries is None:
+            # Walking the tree again needs new scanner
+            yield from self._scan
+            return
+        index = 0
+        while True:
+            if index == len(self._entries):
+                entry = next(self._scan, None)
+                if entry is None:
+                    return
+                self._entries.append(entry)
+            yield self._entries[index]
+            index += 1
+
+
+class FolderWatcher:
+    """Polling detection of new and changed images in folder tree
+
+    Listing of each folder is cached together with its modification time,
+    which changes whenever file is created, deleted or renamed in it, so
+    only changed folders are listed again. Images of unchanged folders are
+    stat'ed, as overwriting file in place does not change its folder. Found
+    images are reported once they are not modified for settle seconds, i.e.
+    they are fully written. Images existing when watching starts are not
+    reported.
+    """
+
+    def __init__(
+        self,
+        folder,
+        img_formats,
+        recursive=False,
+        skip_dirs=(),
+        skip_paths=(),
+        settle=2.0,
+    ):
+        self.folder = folder
+        self.img_formats = tuple(img_formats)
+        self.recursive = recursive
+        self.skip_dirs = set(skip_dirs)
+        self.skip_paths = {os_path.abspath(p) for p in skip_paths}
+        self.settle = settle
+        # Folder path: (its mtime, time of listing, {image: (size, mtime)}, subfolders)
+        self._folders = {}
+        # Images changed since listing of their folder: (size, mtime) seen last
+        self._pending = {}
+        self._refresh()
+        self._pending.clear()
+
+    def _list_folder(self, folder):
+
+        imgs = {}
+        subfolders = []
+        with os_scandir(folder) as entries:
+            for entry in entries:
+                if self.recursive and entry.is_dir(follow_symlinks=False):
+                    if entry.name not in self.skip_dirs and (
+                        os_path.abspath(entry.path) not in self.skip_paths
+                    ):
+                        subfolders.append(entry.path)
+                    continue
+                ext = os_path.splitext(entry.name)[1].lower()
+                if ext in self.img_formats and entry.is_file():
+                    img_stat = entry.stat()
+                    imgs[entry.path] = (img_stat.st_size, img_stat.st_mtime_ns)
+        return imgs, subfolders
+
+    def _refresh(self):
+        """List folders changed since previous check, mark their changed images"""
+
+        seen = set()
+        folders = [self.folder]
+        while folders:
+            folder = folders.pop()
+            seen.add(folder)
+            try:
+                mtime = os_stat(folder).st_mtime_ns
+            except OSError:
+                continue
+            cached = self._folders.get(folder)
+            # Folder changed within the same second as it was listed could be
+            # changed again without visible change of mtime, so it is listed again
+            if (
+                cached is None
+                or cached[0] != mtime
+                or cached[1] - mtime < 1_000_000_000
+            ):
+                listed_at = time.time_ns()
+                try:
+                    imgs, subfolders = self._list_folder(folder)
+                except OSError:
+                    continue
+                old_imgs = cached[2] if cached else {}
+                for img, img_state in imgs.items():
+                    if old_imgs.get(img) != img_state:
+                        self._pending[img] = img_state
+                cached = (mtime, listed_at, imgs, subfolders)
+                self._folders[folder] = cached
+            else:
+                imgs = cached[2]
+                for img, img_state in imgs.items():
+                    try:
+                        img_stat = os_stat(img)
+                    except OSError:
+                        # Removed, folder is listed again at next check
+                        continue
+                    current = (img_stat.st_size, img_stat.st_mtime_ns)
+                    if current != img_state:
+                        imgs[img] = current
+                        self._pending[img] = current
+            folders.extend(cached[3])
+        for folder in set(self._folders) - seen:
+            del self._folders[folder]
+
+    def sync(self, processed):
+        """Take current state of folder tree, forget changes made by processing
+
+        Changes of images for which processed(image, (size, mtime)) is true,
+        e.g. images resized in place, are not reported.
+        """
+
+        self._refresh()
+        for img, img_state in list(self._pending.items()):
+            if processed(img, img_state):
+                del self._pending[img]
+
+    def poll(self):
+        """Return images created or changed since previous poll, fully written"""
+
+        self._refresh()
+        ready = []
+        now = time.time_ns()
+        for img, img_state in list(self._pending.items()):
+            try:
+                img_stat = os_stat(img)
+            except OSError:
+                del self._pending[img]
+                continue
+            current = (img_stat.st_size, img_stat.st_mtime_ns)
+            if current != img_state:
+                # Still being written
+                self._pending[img] = current
+            elif now - img_stat.st_mtime_ns >= self.settle * 1_000_000_000:
+                del self._pending[img]
+                ready.append(img)
+        return ready
+
+
+class MemoryBudget:
+    """Memory reserved by images in flight, limited to given number of bytes
+
+    Image costing more than the whole budget is admitted when nothing else is
+    reserved, so it is processed alone instead of blocking forever.
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.used = 0
+        self._cond = threading_Condition()
+
+    def acquire(self, cost, timeout=None):
+        with self._cond:
+            if not self._cond.wait_for(
+                lambda: self.used == 0 or self.used + cost <= self.limit, timeout
+            ):
+                return False
+            self.used += cost
+            return True
+
+    def release(self, cost):
+        with self._cond:
+            self.used -= cost
+            self._cond.notify_all()
+
+
+class RunLog:
+    """Messages of run, printed to console and optionally written as JSON lines
+
+    Levels: "image" for each processed image, "info" for state of run,
+    "summary" for results, "warning" and "error". In quiet mode only summary,
+    warnings and errors are printed, messages of images are replaced by
+    progress line refreshed at most every progress_interval seconds. Log file
+    "-" means JSON lines on standard output instead of console messages.
+    """
+
+    def __init__(self, quiet=False, log_file=None, progress_interval=0.5):
+        self.quiet = quiet
+        self.progress_interval = progress_interval
+        self.console = log_file != "-"
+        self._log = None
+        if log_file == "-":
+            self._log = sys.stdout
+        elif log_file:
+            # pylint: disable-next=consider-using-with
+            self._log = open(log_file, "a", encoding="utf-8")
+        self._progress_at = 0.0
+        self._progress_shown = False
+        self._lock = threading_Lock()
+
+    def emit(self, level, event, message, **fields):
+        with self._lock:
+            if self._log is not None:
+                record = {
+                    "time": time.time(),
+                    "level": level,
+                    "event": event,
+                    "message": message,
+                    **fields,
+                }
+                self._log.write(json.dumps(record) + "\n")
+                if level != "image":
+                    self._log.flush()
+            if not self.console:
+                return
+            if level == "image" and self.quiet:
+                now = time.perf_counter()
+                if (
+                    "done" in fields
+                    and now - self._progress_at >= self.progress_interval
+                ):
+                    self._progress_at = now
+                    self._progress_shown = True
+                    print(f"\r{fields['done']} files processed...", end="", flush=True)
+                return
+            if level == "info" and self.quiet:
+                return
+            if self._progress_shown:
+                # Progress line is finished before other message
+                print()
+                self._progress_shown = False
+            print(message)
+
+    def close(self):
+        with self._lock:
+            if self._progress_shown:
+                print()
+                self._progress_shown = False
+            if self._log is not None and self._log is not sys.stdout:
+                self._log.close()
+                self._log = None
+
+
+class RunReport:
+    """Timings of pipeline stages of each image, summarized into report file
+
+    Values of each image are seconds spent in stages (keys ending with "_s")
+    and size of source in bytes, total_s is time from reading to writing.
+    """
+
+    STAGES = (
+        "probe_s",
+        "backup_s",
+        "read_s",
+        "dedup_s",
+        "cache_s",
+        "hash_s",
+        "decode_resample_s",
+        "encode_s",
+        "write_s",
+        "total_s",
+    )
+
+    def __init__(self, slowest=10):
+        # Number of slowest images listed in report
+        self.slowest = slowest
+        self.imgs = {}
+        # Run-wide stages, e.g. listing of folders
+        self.totals = {"scan_s": 0.0}
+        self.counts = {
+            "resized": 0,
+            "cached": 0,
+            "duplicates": 0,
+            "up_to_date": 0,
+            "small": 0,
+            "failed": 0,
+        }
+        self._started = time.perf_counter()
+        self._lock = threading_Lock()
+
+    def add(self, img, key, value):
+        with self._lock:
+            values = self.imgs.setdefault(img, {})
+            values[key] = values.get(key, 0) + value
+
+    def timed(self, iterable, key):
+        """Yield items of iterable, time spent in iterable itself is added to key"""
+
+        iterator = iter(iterable)
+        while True:
+            start = time.perf_counter()
+            item = next(iterator, None)
+            self.totals[key] += time.perf_counter() - start
+            if item is None:
+                return
+            yield item
+
+    def add_summary(self, summary):
+        """Add counts of images from summary of run"""
+
+        for key in self.counts:
+            value = summary[key]
+            self.counts[key] += len(value) if isinstance(value, list) else value
+
+    def to_dict(self):
+
+        wall = time.perf_counter() - self._started
+        stages = {stage: 0.0 for stage in self.STAGES}
+        for values in self.imgs.values():
+            for stage in self.STAGES:
+                stages[stage] += values.get(stage, 0)
+        input_mb = sum(values.get("bytes", 0) for values in self.imgs.values())
+        input_mb /= 1024**2
+        slowest = sorted(
+            self.imgs.items(), key=lambda item: -item[1].get("total_s", 0)
+        )[: self.slowest]
+        return {
+            "wall_s": wall,
+            **self.counts,
+            "images_per_s": self.counts["resized"] / wall,
+            "input_mb": input_mb,
+            "mb_per_s": input_mb / wall,
+            "stages_s": {**self.totals, **stages},
+            "slowest": [{"image": img, **values} for img, values in slowest],
+        }
+
+    def save(self, report_file):
+        """Write summary as JSON, or timings of each image if file name ends with .csv"""
+
+        with open(report_file, "w", encoding="utf-8", newline="") as f:
+            if report_file.lower().endswith(".csv"):
+                from csv import writer as csv_writer
+
+                writer = csv_writer(f)
+                writer.writerow(["image", "bytes", *self.STAGES])
+                for img, values in self.imgs.items():
+                    writer.writerow(
+                        [img, values.get("bytes", "")]
+                        + [values.get(stage, "") for stage in self.STAGES]
+                    )
+            else:
+                json.dump(self.to_dict(), f, indent=2)
+
+
+def _user_cache_dir():
+    """Cache folder of tool in home folder of user, as used by other applications"""
+
+    if platform.system() == "Windows":
+        return os_path.join(
+            os_path.expanduser("~"), "AppData", "Local", "pyresizer", "Cache"
+        )
+    if platform.system() == "Darwin":
+        return os_path.join(os_path.expanduser("~"), "Library", "Caches", "pyresizer")
+    cache_home = os_environ.get("XDG_CACHE_HOME") or os_path.join(
+        os_path.expanduser("~"), ".cache"
+    )
+    return os_path.join(cache_home, "pyresizer")
+
+
+class ResizeCache:
+    """Resized images stored on disk, shared by runs in all folders
+
+    Each encoded image is stored in its own file, named by hash of source
+    content, width and encoder settings. Modification time of file is its
+    last use, least recently used ones are removed when cache is over its size.
+    There is no index, so several runs can use cache at once.
+    """
+
+    # Changed when outputs of the same settings change, e.g. other resampling
+    VERSION = 1
+
+    def __init__(self, folder=None, max_bytes=CACHE_BYTES):
+        self.folder = folder or _user_cache_dir()
+        self.max_bytes = max_bytes
+
+    @classmethod
+    def key(
+        cls,
+        src_hash,
+        width,
+        fast,
+        img_format,
+        save_options=None,
+        resampling=None,
+        parent=None,
+    ):
+        """Name of cached image made from source with given settings
+
+        Image made in cascade from image of parent width differs from image
+        made directly from source, so parent width is part of its name.
+        """
+
+        settings = [cls.VERSION, src_hash, width, fast, img_format, save_options]
+        if resampling:
+            settings.append(resampling)
+        if parent:
+            settings.append({"parent": parent})
+        return hashlib_sha256(json.dumps(settings).encode("utf-8")).hexdigest()
+
+    def _path(self, key):
+        # Subfolders keep folders small on file systems slow with many files
+        return os_path.join(self.folder, key[:2], key)
+
+    def get(self, keys):
+        """Return (encoded image, size) pairs of all keys, None if any is missing"""
+
+        outputs = []
+        for key in keys:
+            path = self._path(key)
+            try:
+                data = _read_file(path)
+                os_utime(path)
+            except OSError:
+                return None
+            try:
+                with pil_open(io_BytesIO(data)) as im:
+                    outputs.append((data, list(im.size)))
+            except OSError:
+                # Damaged or foreign file is a miss, it is removed
+                try:
+                    os_remove(path)
+                except OSError:
+                    pass
+                return None
+        return outputs
+
+    def put(self, keys, outputs):
+        for key, (data, _) in zip(keys, outputs):
+            path = self._path(key)
+            os_makedirs(os_path.dirname(path), exist_ok=True)
+            _write_atomic(data, path)
+
+    def _entries(self):
+        """Return (last use, size, path) of cached images"""
+
+        entries = []
+        try:
+            with os_scandir(self.folder) as folders:
+                sub_folders = [f.path for f in folders if f.is_dir()]
+        except FileNotFoundError:
+            return entries
+        for sub_folder in sub_folders:
+            with os_scandir(sub_folder) as files:
+                for f in files:
+                    # Temporary files of writes in progress are hidden
+                    if f.is_file() and not f.name.startswith("."):
+                        f_stat = f.stat()
+                        entries.append((f_stat.st_mtime, f_stat.st_size, f.path))
+        return entries
+
+    def stats(self):
+        entries = self._entries()
+        return {
+            "folder": self.folder,
+            "images": len(entries),
+            "bytes": sum(size for _, size, _ in entries),
+            "max_bytes": self.max_bytes,
+        }
+
+    def prune(self, max_bytes=None):
+        """Remove least recently used images over size, return number of removed"""
+
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+        for _, size, path in entries:
+            if total <= max_bytes:
+                break
+            try:
+                os_remove(path)
+            except FileNotFoundError:
+                # Removed by other run meanwhile
+                pass
+            total -= size
+            removed += 1
+        return removed
 
 
 class Resizer:
     """Main functionality of tool"""
 
-    def __init__(self, new_width):
+    def __init__(
+        self,
+        new_width,
+        jobs=1,
+        fast=False,
+        recursive=False,
+        inflight=None,
+        renditions=None,
+        output=None,
+        out_format=None,
+        save_options=None,
+        memory_budget=None,
+    ):
         # Both sizes could be changed according to requirements
         self.new_width = new_width
+        # Number of worker processes, 1 means resizing in current process
+        self.jobs = jobs
+        # Reduced-size decoding of JPEG images before resampling
+        self.fast = fast
+        # Engine, filter and reducing gap of resampling, see resample_engine().
+        # Pillow with LANCZOS filter if not set
+        self.resampling = None
+        # Threads resizing frames of animation, in each job. Animations are few
+        # and long, so they would be resized by single CPU otherwise. CPUs are
+        # shared by jobs, so threads of all jobs do not oversubscribe them
+        self.frame_jobs = max(1, (os_cpu_count() or 1) // jobs)
+        # Process subfolders too, their structure is mirrored in backup folder
+        self.recursive = recursive
+        # Names of output folders with their widths. If set, originals are not
+        # modified and all sizes are made from single decoding, largest first
+        self.renditions = None
+        if renditions is not None:
+            self.renditions = dict(sorted(renditions.items(), key=lambda r: -r[1]))
+        # Folder for resized images, originals are not modified and not backed up
+        self.output = output
+        # Pillow format of resized images (e.g. "WEBP"), same as source if not set
+        self.out_format = out_format
+        # Pillow save() parameters of each format, see _encoder_options()
+        self.save_options = save_options
+        # Images read, being resized or waiting for write at once, caps memory usage
+        self.inflight = max(2, jobs * 2) if inflight is None else inflight
+        # Bytes of memory used by images in flight at once, estimated from their
+        # dimensions. Not limited if not set
+        self.memory_budget = memory_budget
+        # Images with larger decoded bitmap are read and reduced strip by strip
+        self.large_image_bytes = LARGE_IMAGE_BYTES
+        if memory_budget is not None:
+            self.large_image_bytes = min(LARGE_IMAGE_BYTES, memory_budget // jobs)
+        # Images given by file list, current folder is not scanned if set. Paths
+        # are relative to current folder, or absolute if they are outside of it
+        self.files = None
+        # Widths of some of listed images, other ones are resized to new_width
+        self.file_widths = {}
+        # Resized images of previous runs, see ResizeCache. Not used if not set
+        self.cache = None
+        # Only one of images with the same content is resized, others get its
+        # outputs: "exact" compares hashes of files, "perceptual" also finds
+        # images looking the same. Not used if not set
+        self.dedup = None
         self.img_formats = [".bmp", ".gif", ".jpg", ".jpeg", ".png"]
         self.bak_folder = "bak"
+        # Results of previous runs, used to skip images which are already resized.
+        # Stored in output folder if it is used, source folder may be read-only
+        self.manifest_file = os_path.join(output or "", ".pyresizer-manifest.json")
+        # Progress of current run, kept only if run is interrupted
+        self.journal_file = os_path.join(output or "", ".pyresizer-journal")
+        self._journal = None
+        self._journal_lock = threading_Lock()
+        # Seconds from reading to writing of each image, collected if set to list
+        self.latencies = None
+        # Timings of stages of each image, collected if set to RunReport
+        self.report = None
+        # Destination of messages, see RunLog
+        self.log = RunLog()
+        # User may be asked questions, e.g. whether to continue after error
+        self.interactive = True
+        self._started = {}
+        self.summary = self._new_summary()
+        self._scanner = None
+        # Subfolders already existing in backup folder
+        self._bak_dirs = set()
+        # Checked with first backup, file system of current folder is not changed
+        self._reflink_supported = True
+        # Originals moved to backup folder, restored if resizing fails
+        self._moved = {}
+        # Subfolders already existing in rendition folders
+        self._out_dirs = set()
+        # State of pipeline, set by each run, see _run_pipeline()
+        self._inflight = None
+        self._budget = None
+        self._costs = {}
+        self._originals = {}
+        self._fingerprints = {}
+        self._finished = {}
+        self._stop = None
+
+    @staticmethod
+    def _new_summary():
+        """Counts of images by result of run, failed ones are listed"""
+
+        return {
+            "resized": 0,
+            "cached": 0,
+            "duplicates": 0,
+            "duplicate_bytes": 0,
+            "up_to_date": 0,
+            "small": 0,
+            "failed": [],
+        }
+
+    @property
+    def _encoder(self):
+        """Encoder and resampling settings recorded in manifest, None if defaults"""
+
+        if self.out_format is None and not self.save_options and not self.resampling:
+            return None
+        encoder = {"format": self.out_format, "options": self.save_options}
+        if self.resampling:
+            encoder["resampling"] = self.resampling
+        return encoder
+
+    def _out_name(self, img):
+        """Name of resized image, extension is changed if format is changed"""
+
+        if self.out_format is None:
+            return img
+        return os_path.splitext(img)[0] + "." + self.out_format.lower()
+
+    @staticmethod
+    def _tree_path(img):
+        """Path of image inside backup and output folders
+
+        Images outside of current folder are given by absolute path, which is
+        used there as relative one (like by tar), so folder structure is kept.
+        """
+
+        if not os_path.isabs(img):
+            return img
+        return os_path.splitdrive(img)[1].lstrip("\\/")
+
+    def _width(self, img):
+        """Width of image, given by file list or common one"""
+
+        return self.file_widths.get(img, self.new_width)
+
+    def scan_imgs(self, refresh=False):
+        """Return lazy iterator of DirEntry objects of images in current directory
+
+        Directory is listed once per run, unless refresh is requested, each
+        call of resize_files() is new run. Tree walked in recursive mode is
+        never cached.
+        """
+
+        if self._scanner is None or refresh or self.recursive:
+            self._scanner = ImageScanner(
+                ".",
+                self.img_formats,
+                self.recursive,
+                [self.bak_folder],
+                self._skip_paths,
+            )
+        return self._scanner
+
+    @property
+    def _skip_paths(self):
+        """Folders with outputs, never scanned for images"""
+
+        return [*(self._targets or ()), *([self.output] if self.output else [])]
 
-    # Keep image list always up-to-date
     @property
     def get_imgs(self):
+        # Paths relative to current directory, equal to names in flat mode
+        return [os_path.normpath(entry.path) for entry in self.scan_imgs()]
+
+    def _journal_move(self, img, bak_img):
+        """Record moving of original to backup folder, before it is moved
+
+        Size and modification time identify the original, they are kept by
+        moving. If process is killed, original is moved back by next run.
+        """
+
+        img_stat = os_stat(img)
+        self._write_journal(
+            {
+                "moved": img,
+                "src": bak_img,
+                "state": [img_stat.st_size, img_stat.st_mtime_ns],
+            }
+        )
+
+    def _backup_img(self, img, move=False):
+        """Back up original image to the same relative location in backup folder
+
+        Cheapest safe method is used: copy-on-write clone if file system
+        supports it, otherwise rename into backup folder if moving is allowed,
+        otherwise full copy. Returns path where original can be read from.
+        """
+
+        img_dir = os_path.dirname(self._tree_path(img))
+        if img_dir not in self._bak_dirs:
+            if not os_path.exists(self.bak_folder):
+                os_mkdir(self.bak_folder)
+            if img_dir:
+                os_makedirs(os_path.join(self.bak_folder, img_dir), exist_ok=True)
+            self._bak_dirs.add(img_dir)
+        bak_img = os_path.join(self.bak_folder, self._tree_path(img))
+        if self._reflink_supported:
+            if _reflink(img, bak_img):
+                return img
+            self._reflink_supported = False
+        if move:
+            self._journal_move(img, bak_img)
+            try:
+                os_replace(img, bak_img)
+                return bak_img
+            except OSError as exc:
+                # Backup folder mounted from other device, rename is not possible
+                if exc.errno != errno_EXDEV:
+                    raise
+        shutil_copy2(img, bak_img)
+        return img
+
+    def make_backups(self, imgs=None):
+
+        self.log.emit("info", "backup", "Backing up original images...")
+        try:
+            for i in self.get_imgs if imgs is None else imgs:
+                self._backup_img(i)
+            self.log.emit("info", "backup_done", "Backup created.")
+            return True
+        except IOError:
+            self.log.emit("error", "backup_failed", "Error: unable to create backup!")
+            if not self.interactive:
+                return False
+            dec = input("Do you want to proceed to next step? [y/n]: ")
+            return bool(dec.lower() == "y")
+
+    def load_manifest(self):
+        """Return manifest entries of previous runs, empty if there is no manifest"""
+
+        try:
+            with open(self.manifest_file, "r", encoding="utf-8") as f:
+                return json.load(f)["files"]
+        except FileNotFoundError:
+            return {}
+        except (ValueError, KeyError, TypeError):
+            self.log.emit(
+                "warning",
+                "manifest_damaged",
+                "Warning: manifest is damaged, all images will be processed.",
+            )
+            return {}
+
+    def save_manifest(self, entries):
+
+        tmp_file = f"{self.manifest_file}.tmp"
+        try:
+            with open(tmp_file, "w", encoding="utf-8") as f:
+                json.dump({"version": 1, "files": entries}, f, indent=1)
+                f.flush()
+                os_fsync(f.fileno())
+            os_replace(tmp_file, self.manifest_file)
+        except IOError as exc:
+            raise IOError("Error: unable to save manifest!") from exc
+
+    def _write_journal(self, record):
+
+        with self._journal_lock:
+            if self._journal is not None:
+                self._journal.write(json.dumps(record) + "\n")
+                # Synced after each record, so it survives killing the process
+                # and power loss, and precedes changes it records
+                self._journal.flush()
+                os_fsync(self._journal.fileno())
+
+    def _read_journal(self):
+        """Return records of interrupted run, empty list if there is no journal"""
+
+        records = []
+        try:
+            with open(self.journal_file, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        records.append(json.loads(line))
+                    except ValueError:
+                        # Last line may be incomplete if process was killed
+                        break
+        except FileNotFoundError:
+            pass
+        return records
+
+    def load_run_params(self):
+        """Take parameters of interrupted run from journal, False if there is none"""
+
+        for record in self._read_journal():
+            if "run" in record:
+                self.new_width = record["run"]["width"]
+                self.fast = record["run"]["fast"]
+                self.recursive = record["run"]["recursive"]
+                self.renditions = record["run"].get("renditions")
+                self.output = record["run"].get("output")
+                self.out_format = record["run"].get("out_format")
+                self.save_options = record["run"].get("save_options")
+                self.files = record["run"].get("files")
+                self.file_widths = record["run"].get("file_widths") or {}
+                self.dedup = record["run"].get("dedup")
+                self.resampling = record["run"].get("resampling")
+                return True
+        return False
+
+    def _recover_journal(self, manifest):
+        """Apply progress of interrupted run, return number of finished images
+
+        Results of finished images are added to manifest. Originals moved to
+        backup folder, whose resizing was not finished, are moved back in place.
+        """
+
+        moved = {}
+        finished = 0
+        for record in self._read_journal():
+            if "moved" in record:
+                moved[record["moved"]] = (record["src"], record.get("state"))
+            elif "done" in record:
+                manifest[record["done"]] = record["entry"]
+                moved.pop(record["done"], None)
+                finished += 1
+        for i, (src, state) in moved.items():
+            try:
+                src_stat = os_stat(src)
+            except FileNotFoundError:
+                continue
+            # Record is written before moving, backup of other image with the
+            # same name is never moved in place
+            if state is None or [src_stat.st_size, src_stat.st_mtime_ns] == state:
+                os_replace(src, i)
+        return finished
+
+    @staticmethod
+    def _is_previous_output(img, entry, img_stat=None):
+        """Check if image is unchanged output of previous run
+
+        Size and modification time are compared first, content is hashed only
+        when they differ (e.g. after copying folder). Image is never decoded.
+        """
+
+        if not entry:
+            return False
+        try:
+            if img_stat is None:
+                img_stat = os_stat(img)
+            if (img_stat.st_size, img_stat.st_mtime_ns) == (
+                entry["out_size"],
+                entry["out_mtime_ns"],
+            ):
+                return True
+            if img_stat.st_size != entry["out_size"]:
+                return False
+            if _file_hash(img) == entry["out_hash"]:
+                entry["out_mtime_ns"] = img_stat.st_mtime_ns
+                return True
+        except (OSError, KeyError):
+            pass
+        return False
+
+    @property
+    def _targets(self):
+        """Output folders with their widths, None if images are resized in place"""
+
+        if self.renditions is None and self.output is None:
+            return None
+        if self.renditions is None:
+            return {self.output: self.new_width}
+        return {
+            os_path.join(self.output or "", name): width
+            for name, width in self.renditions.items()
+        }
+
+    def _img_targets(self, img):
+        """Output folders with widths of image, None if it is resized in place"""
+
+        if self.renditions is None and self.output is not None:
+            return {self.output: self._width(img)}
+        return self._targets
+
+    def _out_path(self, folder, img):
+        """Path of resized image in output folder"""
+
+        return os_path.join(folder, self._out_name(self._tree_path(img)))
+
+    def _targets_up_to_date(self, img, entry, img_stat=None):
+        """Check if source is unchanged and all its outputs exist"""
+
+        if (
+            not entry
+            or entry.get("targets") != self._img_targets(img)
+            or entry.get("encoder") != self._encoder
+        ):
+            return False
+        try:
+            if img_stat is None:
+                img_stat = os_stat(img)
+            if (img_stat.st_size, img_stat.st_mtime_ns) != (
+                entry["src_size"],
+                entry["src_mtime_ns"],
+            ):
+                return False
+        except (OSError, KeyError):
+            return False
+        return all(os_path.exists(self._out_path(name, img)) for name in self._targets)
+
+    def _is_up_to_date(self, img, entry, img_stat=None):
+        """Check if image is output of previous run with the same width"""
+
+        if self._targets is not None:
+            return self._targets_up_to_date(img, entry, img_stat)
+        return (
+            bool(entry)
+            and entry.get("width") == self._width(img)
+            and entry.get("encoder") == self._encoder
+            and self._is_previous_output(img, entry, img_stat)
+        )
+
+    def _queue_imgs(self, manifest, imgs=None):
+        """Yield image, source, size, reduced decoding and frames of images to resize
+
+        Images found in current folder are checked, unless list of image
+        paths is given. Each image is backed up right before it is queued.
+        """
+
+        listing = self.scan_imgs() if imgs is None else imgs
+        if self.report is not None:
+            listing = self.report.timed(listing, "scan_s")
+        for dir_entry in listing:
+            if isinstance(dir_entry, str):
+                i = os_path.normpath(dir_entry)
+                # Listed files are not filtered by scanner
+                if os_path.splitext(i)[1].lower() not in self.img_formats:
+                    self.log.emit(
+                        "error",
+                        "unsupported",
+                        f"Error: {i} is not supported image!",
+                        image=i,
+                    )
+                    self.summary["failed"].append(i)
+                    continue
+                entry = manifest.get(i)
+                img_stat = None
+            else:
+                i = os_path.normpath(dir_entry.path)
+                entry = manifest.get(i)
+                # Stat result is cached by DirEntry, file is not stat'ed repeatedly
+                img_stat = dir_entry.stat() if entry else None
+            if self._is_up_to_date(i, entry, img_stat):
+                self.summary["up_to_date"] += 1
+                continue
+            probe = self._timed(i, "probe_s", _probe_img, i)
+            size, reduction, frames = probe or (None, None, 1)
+            # Originals are not modified, backup is not needed
+            if self._targets is not None:
+                yield i, i, size, reduction, frames
+                continue
+            # Image would not be changed by resizing, only re-encoded
+            if size is not None and size[0] <= self._width(i):
+                self.summary["small"] += 1
+                continue
+            # Outputs of previous runs with other width are not backed up again,
+            # backup folder already contains their originals
+            src = i
+            if not self._is_previous_output(i, entry, img_stat):
+                try:
+                    src = self._timed(i, "backup_s", self._backup_img, i, True)
+                except IOError as exc:
+                    self.log.emit(
+                        "error",
+                        "backup_failed",
+                        f"Error: unable to create backup of {i}: {exc}",
+                        image=i,
+                    )
+                    self.summary["failed"].append(i)
+                    continue
+            if src != i:
+                self._moved[i] = src
+            yield i, src, size, reduction, frames
+
+    def _timed(self, img, key, func, *args):
+        """Call function, its duration is recorded as stage of image in report"""
+
+        if self.report is None:
+            return func(*args)
+        start = time.perf_counter()
+        try:
+            return func(*args)
+        finally:
+            self.report.add(img, key, time.perf_counter() - start)
+
+    def _memory_cost(self, img, src, size, reduction=None, frames=1):
+        """Estimated peak memory usage of image in bytes, from its dimensions
+
+        Decoded bitmaps are counted with 4 bytes per pixel, whole bitmap unless
+        reduced decoding (see _probe_img()) applies. Animations hold decoded
+        frames in flight in frame threads and all shrunk frames until encoding.
+        Returns cost and whether image is large, i.e. not read into memory and
+        decoded from file.
+        """
+
+        if size is None:
+            return 0, False
+        width, height = size
+        decoded = width * height * 4
+        new_width = self._widths(img)[0]
+        out = new_width * new_width * height // width * 4
+        large = decoded > self.large_image_bytes
+        if frames > 1:
+            # Frames in flight (see _resize_frames()) and frame of decoder
+            decoded *= self.frame_jobs * 2 + 1
+            out = frames * sum(w * w * height // width * 4 for w in self._widths(img))
+        elif reduction == "strips" and large:
+            # Same factor as in _shrink_large()
+            factor = width // (new_width * 2)
+            if factor > 1:
+                return decoded // factor**2 + STRIP_BYTES + out, True
+        elif reduction == "draft" and (large or self.fast):
+            decoded //= _draft_scale(size, new_width) ** 2
+        if large:
+            return decoded + out, True
+        try:
+            # Encoded data is kept in memory too
+            return os_stat(src).st_size + decoded + out, False
+        except OSError:
+            return decoded + out, False
+
+    def _release(self, img):
+        """Free place of image in the pipeline"""
+
+        if self._budget is not None:
+            self._budget.release(self._costs.pop(img, 0))
+        self._inflight.release()
+
+    def _restore_img(self, img):
+        """Move original back in place of image, which was not resized"""
+
+        src = self._moved.pop(img, None)
+        if src is not None and not os_path.exists(img):
+            os_replace(src, img)
+
+    def _read_stage(self, manifest, imgs, read_q, write_q, errors):
+        """Pipeline thread: scan, back up and read images ahead of resizing
+
+        Number of images in the pipeline is limited by in-flight semaphore and
+        memory budget, released by writer stage. Large images are not read,
+        only their file name is passed. Duplicates are passed to writer stage
+        directly.
+        """
+
+        try:
+            for i, src, size, *probe in self._queue_imgs(manifest, imgs):
+                # Released by writer stage, see _release()
+                # pylint: disable-next=consider-using-with
+                while not self._inflight.acquire(timeout=0.1):
+                    if self._stop.is_set():
+                        return
+                cost, large = self._memory_cost(i, src, size, *probe)
+                if self._budget is not None:
+                    while not self._budget.acquire(cost, timeout=0.1):
+                        if self._stop.is_set():
+                            return
+                    self._costs[i] = cost
+                if self.latencies is not None or self.report is not None:
+                    self._started[i] = time.perf_counter()
+                try:
+                    data = src
+                    if not large:
+                        data = self._timed(i, "read_s", _read_file, src)
+                        if self.report is not None:
+                            self.report.add(i, "bytes", len(data))
+                    original = src_hash = outputs = None
+                    if self.dedup is not None:
+                        original, src_hash = self._timed(
+                            i, "dedup_s", self._find_duplicate, i, data, size
+                        )
+                    if original is None and self.cache is not None and size:
+                        outputs, src_hash = self._timed(
+                            i, "cache_s", self._cached_outputs, i, data, src_hash
+                        )
+                    if outputs is not None:
+                        # Taken from cache, writer stage saves them like resized ones
+                        entry = {"src_hash": src_hash, "src_dims": list(size)}
+                        write_q.put((i, outputs, {**entry, "cached": True}, None))
+                    elif original is None:
+                        # Hash is passed on, large source is not read again
+                        read_q.put((i, data, src_hash, None))
+                    else:
+                        # Not resized, writer stage copies outputs of original
+                        entry = {"duplicate_of": original, "src_hash": src_hash}
+                        src_bytes = os_stat(src).st_size if large else len(data)
+                        write_q.put((i, src_bytes, entry, None))
+                except IOError as exc:
+                    read_q.put((i, None, None, exc))
+                if self._stop.is_set():
+                    return
+        except BaseException as exc:  # pylint: disable=broad-exception-caught
+            errors.append(exc)
+            self._stop.set()
+        finally:
+            read_q.put(None)
+
+    def _find_duplicate(self, img, data, size):
+        """Find earlier image of run with the same content, return it and hash of image
+
+        Images are compared by hash of file and in perceptual mode also by
+        perceptual hash, only with images of the same size. Outputs of both
+        images must be the same, i.e. have the same format and widths. First
+        image of each group is resized, the others get its outputs. Image is
+        None if there is no such one.
+        """
+
+        src_hash = _src_hash(data)
+        outputs_key = (
+            os_path.splitext(self._out_name(img))[1].lower(),
+            tuple(self._widths(img)),
+        )
+        original = self._originals.setdefault((src_hash, outputs_key), img)
+        if original != img:
+            return original, src_hash
+        # Large images are not decoded even at reduced size
+        if self.dedup != "perceptual" or size is None or isinstance(data, str):
+            return None, src_hash
+        fingerprint = _dhash(data)
+        if fingerprint is None:
+            return None, src_hash
+        similar = self._fingerprints.setdefault(
+            (tuple(size), outputs_key), FingerprintIndex()
+        )
+        other = similar.find(fingerprint)
+        if other is not None:
+            # Next copies of this file are duplicates of the same original
+            self._originals[(src_hash, outputs_key)] = other
+            return other, src_hash
+        similar.add(fingerprint, img)
+        return None, src_hash
+
+    def _cache_keys(self, img, src_hash):
+        """Names of outputs of image in cache"""
+
+        img_format = self.out_format
+        if img_format is None:
+            img_format = pil_registered_extensions()[os_path.splitext(img)[1].lower()]
+        save_options = (self.save_options or {}).get(img_format)
+        widths = self._widths(img)
+        # Each width after the first is made from the previous one
         return [
-            str(i)
-            for i in os_listdir()
-            if os_path.isfile(i) and any(x in i.lower() for x in self.img_formats)
+            ResizeCache.key(
+                src_hash,
+                width,
+                self.fast,
+                img_format,
+                save_options,
+                self.resampling,
+                parent,
+            )
+            for width, parent in zip(widths, [None] + widths[:-1])
         ]
 
-    def make_backups(self):
+    def _cached_outputs(self, img, data, src_hash=None):
+        """Return outputs of image from cache (None if they are not there) and its hash"""
 
-        print("Backing up original images...")
-        try:
-            if not os_path.exists(self.bak_folder):
-                os_mkdir(self.bak_folder)
-            for i in self.get_imgs:
-                shutil_copy2(i, os_path.join(self.bak_folder, i))
-            print("Backup created.")
-            return True
-        except IOError:
-            print("Error: unable to create backup!")
-            dec = input("Do you want to proceed to next step? [y/n]: ")
-            return bool(dec.lower() == "y")
+        if src_hash is None:
+            src_hash = _src_hash(data)
+        return self.cache.get(self._cache_keys(img, src_hash)), src_hash
 
-    def resize_files(self):
+    def _job_done(self, img, write_q, future):
+        """Pass result of worker process to writer stage"""
 
-        imgs_quantity = len(self.get_imgs)
-        if imgs_quantity > 0:
-            print(f"{imgs_quantity} files will be processed")
+        if future.cancelled():
+            self._release(img)
+            return
+        exc = future.exception()
+        if exc is None:
+            write_q.put((img, *future.result(), None))
         else:
-            print("No images to be processed.")
-            return True
+            write_q.put((img, None, None, exc))
+
+    def _compute_stage(self, read_q, write_q, executor=None):
+        """Decode, resize and encode images, in current thread or process pool
+
+        Pool is shut down when all images are resized.
+        """
+
+        if executor is None:
+            for i, data, src_hash, exc in iter(read_q.get, None):
+                if exc is None:
+                    try:
+                        outputs = _resize_data(
+                            i, data, *self._resize_args(i), src_hash=src_hash
+                        )
+                        write_q.put((i, *outputs, None))
+                    except IOError as resize_exc:
+                        write_q.put((i, None, None, resize_exc))
+                else:
+                    write_q.put((i, None, None, exc))
+            return
+
+        try:
+            for i, data, src_hash, exc in iter(read_q.get, None):
+                if exc is None:
+                    future = executor.submit(
+                        _resize_data,
+                        i,
+                        data,
+                        *self._resize_args(i),
+                        src_hash=src_hash,
+                    )
+                    future.add_done_callback(
+                        functools_partial(self._job_done, i, write_q)
+                    )
+                else:
+                    write_q.put((i, None, None, exc))
+        except BaseException:
+            # Interrupted, images not being resized yet are dropped
+            executor.shutdown(cancel_futures=True)
+            raise
+        executor.shutdown()
+
+    def _resize_args(self, img):
+        """Arguments of _resize_data() following image name and data"""
+
+        return (
+            self._widths(img),
+            self.fast,
+            self.out_format,
+            self.save_options,
+            self.frame_jobs,
+            self.resampling,
+        )
+
+    def _widths(self, img=None):
+        """Widths of image outputs, common ones if image is not given"""
+
+        targets = self._img_targets(img)
+        if targets is None:
+            return [self._width(img)]
+        return list(targets.values())
+
+    def _save_outputs(self, img, outputs, entry):
+        """Write resized images and complete manifest entry"""
+
+        targets = self._img_targets(img)
+        if targets is None:
+            data, dims = outputs[0]
+            out_stat = _write_atomic(data, img)
+            entry["width"] = self._width(img)
+            entry["encoder"] = self._encoder
+            entry["dims"] = dims
+            entry["out_hash"] = hashlib_sha256(data).hexdigest()
+            entry["out_size"] = out_stat.st_size
+            entry["out_mtime_ns"] = out_stat.st_mtime_ns
+            return
+        for name, (data, _) in zip(targets, outputs):
+            _write_atomic(data, self._make_out_dir(name, img))
+        src_stat = os_stat(img)
+        entry["targets"] = targets
+        entry["encoder"] = self._encoder
+        entry["dims"] = {name: dims for name, (_, dims) in zip(targets, outputs)}
+        entry["src_size"] = src_stat.st_size
+        entry["src_mtime_ns"] = src_stat.st_mtime_ns
+
+    def _store_cached(self, img, outputs, entry):
+        """Put outputs of image into cache, run does not fail if it is not possible"""
+
+        try:
+            self.cache.put(self._cache_keys(img, entry["src_hash"]), outputs)
+        except OSError as exc:
+            self.log.emit(
+                "warning",
+                "cache_failed",
+                f"Warning: unable to store {img} in cache: {exc}",
+                image=img,
+            )
+
+    def _make_out_dir(self, folder, img):
+        """Create folder of resized image in output folder, return its path"""
+
+        out_img = self._out_path(folder, img)
+        out_dir = os_path.dirname(out_img)
+        if out_dir not in self._out_dirs:
+            os_makedirs(out_dir, exist_ok=True)
+            self._out_dirs.add(out_dir)
+        return out_img
+
+    def _save_duplicate(self, manifest, img, entry):
+        """Copy outputs of original image and make manifest entry from its one
+
+        Originals are never modified in place, so outputs in output folders
+        are hard linked if copy-on-write clone is not possible.
+        """
+
+        original = entry["duplicate_of"]
+        entry.update({**manifest[original], **entry})
+        targets = self._img_targets(img)
+        if targets is None:
+            out_stat = _clone_file(original, img)
+            entry["out_size"] = out_stat.st_size
+            entry["out_mtime_ns"] = out_stat.st_mtime_ns
+            return
+        for name in targets:
+            _clone_file(
+                self._out_path(name, original),
+                self._make_out_dir(name, img),
+                hardlink=True,
+            )
+        src_stat = os_stat(img)
+        entry["src_size"] = src_stat.st_size
+        entry["src_mtime_ns"] = src_stat.st_mtime_ns
+
+    def _finish_duplicate(self, manifest, img, src_bytes, entry):
+        """Give outputs of finished original to duplicate, or fail it like original"""
+
+        original = entry["duplicate_of"]
+        exc = self._finished[original]
+        if exc is None:
+            try:
+                self._save_duplicate(manifest, img, entry)
+            except IOError as save_exc:
+                exc = save_exc
+        if exc is not None:
+            self.log.emit(
+                "error",
+                "failed",
+                f"Error: resizing {img} (duplicate of {original}) failed: {exc}",
+                image=img,
+            )
+            self.summary["failed"].append(img)
+            self._restore_img(img)
+            return
+        self._moved.pop(img, None)
+        self._write_journal({"done": img, "entry": entry})
+        manifest[img] = entry
+        self.summary["duplicates"] += 1
+        self.summary["duplicate_bytes"] += src_bytes
+        self.log.emit(
+            "image",
+            "duplicate",
+            f"{img} is duplicate of {original}, its outputs are copied.",
+            image=img,
+            original=original,
+        )
+
+    def _write_stage(self, manifest, write_q, errors):
+        """Pipeline thread: save resized images and record results"""
+
+        # Duplicates of images not resized yet, by their originals
+        waiting = {}
+        try:
+            for i, data, entry, exc in iter(write_q.get, None):
+                try:
+                    if exc is None and "duplicate_of" in entry:
+                        # Size of source is passed instead of its data
+                        if entry["duplicate_of"] in self._finished:
+                            self._finish_duplicate(manifest, i, data, entry)
+                        else:
+                            waiting.setdefault(entry["duplicate_of"], []).append(
+                                (i, data, entry)
+                            )
+                        continue
+                    cached = exc is None and entry.pop("cached", False)
+                    if exc is None:
+                        timings = entry.pop("timings", {})
+                        if self.report is not None:
+                            for key, seconds in timings.items():
+                                self.report.add(i, key, seconds)
+                        try:
+                            self._timed(
+                                i, "write_s", self._save_outputs, i, data, entry
+                            )
+                        except IOError as write_exc:
+                            exc = write_exc
+                    # Only I/O related errors are aggregated, others stop processing
+                    if exc is not None and not isinstance(exc, IOError):
+                        raise exc
+                    if exc is not None:
+                        self.log.emit(
+                            "error",
+                            "failed",
+                            f"Error: resizing {i} failed: {exc}",
+                            image=i,
+                        )
+                        self.summary["failed"].append(i)
+                        self._restore_img(i)
+                    else:
+                        self._moved.pop(i, None)
+                        self._write_journal({"done": i, "entry": entry})
+                        manifest[i] = entry
+                        self.summary["resized"] += 1
+                        if cached:
+                            self.summary["cached"] += 1
+                        elif self.cache is not None:
+                            self._store_cached(i, data, entry)
+                        self.log.emit(
+                            "image",
+                            "resized",
+                            f"Resizing {i} finished ({self.summary['resized']} done).",
+                            image=i,
+                            done=self.summary["resized"],
+                        )
+                    if self.dedup is not None:
+                        self._finished[i] = exc
+                        for dup in waiting.pop(i, []):
+                            self._finish_duplicate(manifest, *dup)
+                finally:
+                    if i in self._started:
+                        latency = time.perf_counter() - self._started.pop(i)
+                        if self.latencies is not None:
+                            self.latencies.append(latency)
+                        if self.report is not None:
+                            self.report.add(i, "total_s", latency)
+                    self._release(i)
+        except BaseException as exc:  # pylint: disable=broad-exception-caught
+            errors.append(exc)
+            self._stop.set()
+
+    def _run_pipeline(self, manifest, imgs=None):
+        """Resize images in three stages connected by queues
+
+        Reading of next images and writing of previous ones overlap with
+        resizing, so CPU does not wait for I/O and vice versa. Images are
+        encoded by compute stage, as sending encoded data from worker processes
+        is much cheaper than decoded pixels.
+        """
+
+        # Pillow and its plugins are imported by main thread, before stages
+        # start, not concurrently by them
+        _pil().init()
+        self._inflight = threading_BoundedSemaphore(self.inflight)
+        self._budget = None
+        if self.memory_budget is not None:
+            self._budget = MemoryBudget(self.memory_budget)
+        self._costs = {}
+        # Images of run by hash of content and outputs, see _find_duplicate()
+        self._originals = {}
+        self._fingerprints = {}
+        # Errors of finished originals, None if they succeeded
+        self._finished = {}
+        self._stop = threading_Event()
+        read_q = queue_Queue()
+        write_q = queue_Queue()
+        errors = []
+        reader = threading_Thread(
+            target=self._read_stage,
+            args=(manifest, imgs, read_q, write_q, errors),
+            daemon=True,
+        )
+        writer = threading_Thread(
+            target=self._write_stage, args=(manifest, write_q, errors), daemon=True
+        )
+        # Pool is created before stage threads are started, its workers are
+        # not forked from this process anyway, see _process_pool()
+        executor = _process_pool(self.jobs) if self.jobs > 1 else None
+        reader.start()
+        writer.start()
+        try:
+            self._compute_stage(read_q, write_q, executor)
+        finally:
+            self._stop.set()
+            reader.join()
+            # Results already computed are still written
+            write_q.put(None)
+            writer.join()
+        if errors:
+            raise errors[0]
+
+    def _is_processed(self, manifest, img, img_state):
+        """Check if image in state (size, mtime) is recorded in manifest as processed"""
+
+        entry = manifest.get(os_path.normpath(img))
+        if not entry:
+            return False
+        if self._targets is None:
+            return (entry.get("out_size"), entry.get("out_mtime_ns")) == img_state
+        return (entry.get("src_size"), entry.get("src_mtime_ns")) == img_state
+
+    def watch(self, interval=2.0):
+        """Resize images in current folder, then keep resizing new and changed ones
+
+        Folder is polled every interval seconds, image is resized when it is
+        not modified for the same time. Runs until interrupted.
+        """
+
+        watcher = FolderWatcher(
+            ".",
+            self.img_formats,
+            self.recursive,
+            [self.bak_folder],
+            self._skip_paths,
+            interval,
+        )
+        imgs = None
+        try:
+            while True:
+                if imgs is None or imgs:
+                    try:
+                        self.resize_files(imgs)
+                    except IOError as exc:
+                        # Failed images are tried again when they are changed
+                        self.log.emit("error", "run_failed", str(exc))
+                    # Tree is taken after run, so its outputs are not reported
+                    # as changed images, but images added meanwhile are
+                    watcher.sync(
+                        functools_partial(self._is_processed, self.load_manifest())
+                    )
+                    self.log.emit(
+                        "info",
+                        "watching",
+                        "Watching for new images, press CTRL+C to stop...",
+                    )
+                time.sleep(interval)
+                imgs = watcher.poll()
+        except KeyboardInterrupt:
+            self.log.emit("info", "watch_stopped", "Watching stopped.")
+
+    def resize_files(self, imgs=None):
+        """Resize images in current folder, or only given ones (paths relative to it)
+
+        Images of file list are resized, if it is set and images are not given.
+        """
+
+        # Listing and stats of previous call are outdated
+        self._scanner = None
+        manifest = self.load_manifest()
+        finished = self._recover_journal(manifest)
+        if finished > 0:
+            # Journal is truncated below, results of interrupted run are kept
+            # even if this run is killed too
+            self.save_manifest(manifest)
+            self.log.emit(
+                "info",
+                "recovered",
+                f"Interrupted run found, {finished} files were already finished.",
+                finished=finished,
+            )
+        self.summary = self._new_summary()
+        if self.jobs > 1:
+            self.log.emit(
+                "info",
+                "jobs",
+                f"Resizing in {self.jobs} parallel jobs...",
+                jobs=self.jobs,
+            )
+        if self.output:
+            os_makedirs(self.output, exist_ok=True)
+        completed = False
+        # pylint: disable-next=consider-using-with
+        self._journal = open(self.journal_file, "w", encoding="utf-8")
+        self._write_journal(
+            {
+                "run": {
+                    "width": self.new_width,
+                    "fast": self.fast,
+                    "recursive": self.recursive,
+                    "renditions": self.renditions,
+                    "output": self.output,
+                    "out_format": self.out_format,
+                    "save_options": self.save_options,
+                    "files": self.files,
+                    "file_widths": self.file_widths,
+                    "dedup": self.dedup,
+                    "resampling": self.resampling,
+                }
+            }
+        )
         try:
-            self.make_backups()
-            for index, i in enumerate(self.get_imgs):
-                print(f"Resizing {i} ({index+1} of {imgs_quantity})...")
-                im = pil_open(i)
-                im_width, im_height = im.size
-                new_height = self.new_width * im_height / im_width
-                img_dims = (self.new_width, new_height)
-                im.thumbnail(img_dims, pil_Resampling.LANCZOS)
-                im.save(i)
-                print(f"Resizing {i} finished.")
-            print("Processing finished.")
+            self._run_pipeline(manifest, self.files if imgs is None else imgs)
+            completed = True
+        finally:
+            # Originals of images interrupted during resizing are put back
+            for i in list(self._moved):
+                self._restore_img(i)
+            # Keep results of finished images even if processing was interrupted
+            self.save_manifest(manifest)
+            if self.report is not None:
+                self.report.add_summary(self.summary)
+            self._journal.close()
+            self._journal = None
+            if completed:
+                os_remove(self.journal_file)
+            # Cache is listed only if it has grown
+            if (
+                self.cache is not None
+                and self.summary["resized"] > self.summary["cached"]
+            ):
+                self.cache.prune()
+        if self.summary["up_to_date"] > 0:
+            self.log.emit(
+                "summary",
+                "up_to_date",
+                f"{self.summary['up_to_date']} files already resized "
+                + f"to width {'/'.join(str(w) for w in self._widths())}, skipped.",
+                count=self.summary["up_to_date"],
+            )
+        if self.summary["cached"] > 0:
+            self.log.emit(
+                "summary",
+                "cached",
+                f"{self.summary['cached']} files taken from cache instead of resizing.",
+                count=self.summary["cached"],
+            )
+        if self.summary["duplicates"] > 0:
+            self.log.emit(
+                "summary",
+                "duplicates",
+                f"{self.summary['duplicates']} duplicates got outputs of their "
+                + "originals instead of resizing "
+                + f"({self.summary['duplicate_bytes'] / 1024**2:.1f} MB not decoded).",
+                count=self.summary["duplicates"],
+                bytes=self.summary["duplicate_bytes"],
+            )
+        if self.summary["small"] > 0:
+            self.log.emit(
+                "summary",
+                "small",
+                f"{self.summary['small']} files not wider than {self.new_width}px, "
+                + "skipped.",
+                count=self.summary["small"],
+            )
+        if self.summary["failed"]:
+            self.log.emit(
+                "summary",
+                "failed",
+                f"{len(self.summary['failed'])} files failed.",
+                count=len(self.summary["failed"]),
+            )
+            raise IOError("Error: some files were not processed!")
+        if self.summary["resized"] == 0:
+            self.log.emit("summary", "finished", "No images to be processed.", count=0)
             return True
+        self.log.emit(
+            "summary",
+            "finished",
+            f"Processing finished, {self.summary['resized']} files resized.",
+            count=self.summary["resized"],
+        )
+        return True
+
+
+class ResizeServer:
+    """HTTP service resizing images in process pool
+
+    POST /resize?width=1280[&format=webp] with image as body returns resized
+    image, GET /health returns state of service as JSON. Number of images
+    resized at once is limited by jobs, requests over max_pending are rejected
+    immediately (503), requests not finished in timeout seconds get 504.
+    """
+
+    def __init__(
+        self,
+        host="127.0.0.1",
+        port=8080,
+        jobs=1,
+        max_pending=None,
+        timeout=30,
+        new_width=1920,
+        fast=False,
+        out_format=None,
+        save_options=None,
+        max_size=100 * 1024**2,
+        resampling=None,
+    ):
+        self.host = host
+        # Port 0 means any free port, actual one is set when server is started
+        self.port = port
+        self.jobs = jobs
+        # Requests being resized or waiting for it, others are rejected
+        self.max_pending = jobs * 4 if max_pending is None else max_pending
+        self.timeout = timeout
+        # Defaults of requests not specifying them
+        self.new_width = new_width
+        self.fast = fast
+        self.out_format = out_format
+        self.save_options = save_options
+        # Engine, filter and reducing gap of resampling, see resample_engine()
+        self.resampling = resampling
+        # Largest accepted request body in bytes
+        self.max_size = max_size
+        self.pending = 0
+        self.served = 0
+        self._server = None
+        self._executor = None
+        self._slots = None
+
+    async def start(self):
+        import asyncio
+
+        self._executor = _process_pool(self.jobs)
+        self._slots = asyncio.Semaphore(self.jobs)
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        self._server.close()
+        await self._server.wait_closed()
+        self._executor.shutdown(cancel_futures=True)
+
+    def run(self):
+        """Serve until interrupted"""
+
+        import asyncio
+
+        async def serve():
+            await self.start()
+            print(f"Serving on http://{self.host}:{self.port}, press CTRL+C to stop.")
+            try:
+                await self._server.serve_forever()
+            finally:
+                await self.stop()
+
+        try:
+            asyncio.run(serve())
+        except KeyboardInterrupt:
+            pass
+
+    @staticmethod
+    async def _read_head(reader):
+        """Read request line and headers, return method, target and headers"""
+
+        request_line = await reader.readline()
+        method, target, _ = request_line.decode("latin-1").split(" ", 2)
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                return method, target, headers
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+    async def _respond(self, reader):
+        """Read request, return status, body and content type of response
+
+        Receiving of request and resizing have timeout each.
+        """
+
+        import asyncio
+        from urllib.parse import parse_qs as urllib_parse_qs
+        from urllib.parse import urlsplit as urllib_urlsplit
+
+        try:
+            method, target, headers = await asyncio.wait_for(
+                self._read_head(reader), self.timeout
+            )
+        except ValueError:
+            return 400, "Error: malformed request line!", "text/plain"
+        except asyncio.TimeoutError:
+            return 408, "Error: request not received in time!", "text/plain"
+        url = urllib_urlsplit(target)
+        if url.path == "/health" and method == "GET":
+            return (
+                200,
+                json.dumps(
+                    {
+                        "status": "ok",
+                        "pending": self.pending,
+                        "max_pending": self.max_pending,
+                        "jobs": self.jobs,
+                        "served": self.served,
+                    }
+                ),
+                "application/json",
+            )
+        if url.path not in ("/health", "/resize"):
+            return 404, "Error: not found!", "text/plain"
+        if method != "POST" or url.path != "/resize":
+            return 405, "Error: method not allowed!", "text/plain"
+        try:
+            length = int(headers["content-length"])
+        except KeyError:
+            return 411, "Error: Content-Length header is required!", "text/plain"
+        except ValueError:
+            return 400, "Error: invalid Content-Length header!", "text/plain"
+        if length > self.max_size:
+            return 413, f"Error: image larger than {self.max_size} bytes!", "text/plain"
+        query = {key: values[-1] for key, values in urllib_parse_qs(url.query).items()}
+        try:
+            args = self._resize_args(query)
+        except ValueError as exc:
+            return 400, f"Error: {exc}!", "text/plain"
+        # Checked before body is read, so overloaded service answers at once
+        # and does not buffer uploads it would reject anyway
+        if self.pending >= self.max_pending:
+            return 503, "Error: too many pending requests!", "text/plain"
+        self.pending += 1
+        try:
+            try:
+                body = await asyncio.wait_for(reader.readexactly(length), self.timeout)
+            except asyncio.IncompleteReadError:
+                return 400, "Error: incomplete request body!", "text/plain"
+            except asyncio.TimeoutError:
+                return 408, "Error: request not received in time!", "text/plain"
+            try:
+                return await asyncio.wait_for(self._resize(body, args), self.timeout)
+            except asyncio.TimeoutError:
+                # Worker process cannot be interrupted, its result is dropped
+                return 504, "Error: image not resized in time!", "text/plain"
+        finally:
+            self.pending -= 1
+
+    def _resize_args(self, query):
+        """Arguments of resize_image() from query of request"""
+
+        width = int(query.get("width", self.new_width))
+        if width < 1:
+            raise ValueError("width must be at least 1")
+        out_format = self.out_format
+        if query.get("format"):
+            out_format = query["format"].upper()
+            # Registered extensions list also formats Pillow can only read
+            _pil().init()
+            if out_format not in _pil().SAVE:
+                raise ValueError(f"format {query['format']} is not supported")
+        return width, self.fast, out_format, self.save_options, 1, self.resampling
+
+    def _free_slot(self, loop, _):
+        """Free slot of finished job, called by thread of process pool"""
+
+        try:
+            loop.call_soon_threadsafe(self._slots.release)
+        except RuntimeError:
+            # Event loop is closed, service was stopped meanwhile
+            pass
+
+    async def _resize(self, body, args):
+        """Return status, body and content type of /resize response
+
+        Slot of job is freed only when worker process finishes, even if request
+        has timed out meanwhile, so process pool is never oversubscribed.
+        """
+
+        import asyncio
+
+        loop = asyncio.get_running_loop()
+        await self._slots.acquire()
+        try:
+            future = self._executor.submit(resize_image, body, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(functools_partial(self._free_slot, loop))
+        try:
+            data = await asyncio.wrap_future(future)
         except IOError as exc:
-            raise IOError("Error: some files were not processed!") from exc
+            return 400, f"Error: unable to resize image: {exc}", "text/plain"
+        except Exception as exc:  # pylint: disable=broad-exception-caught
+            # Client is answered even if worker fails unexpectedly
+            return 500, f"Error: unable to resize image: {exc!r}", "text/plain"
+        self.served += 1
+        img_format = args[2] or pil_open(io_BytesIO(body)).format
+        return 200, data, _pil().MIME.get(img_format, "application/octet-stream")
+
+    async def _handle(self, reader, writer):
+        """Answer single request, connection is closed afterwards"""
+
+        from http import HTTPStatus as http_HTTPStatus
+
+        try:
+            status, body, content_type = await self._respond(reader)
+            if isinstance(body, str):
+                body = body.encode("utf-8")
+            headers = [
+                f"HTTP/1.1 {status} {http_HTTPStatus(status).phrase}",
+                f"Content-Type: {content_type}",
+                f"Content-Length: {len(body)}",
+                "Connection: close",
+            ]
+            if status == 503:
+                headers.append("Retry-After: 1")
+            writer.write(("\r\n".join(headers) + "\r\n\r\n").encode("latin-1"))
+            writer.write(body)
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
 
 
 class InstallerUninstaller:
@@ -118,6 +2754,8 @@ class InstallerUninstaller:
     def _remove_from_windows_context_menu(self):
 
         if platform.system() == "Windows":
+            import winreg
+
             try:
                 print("Removing application from context menu registry keys...")
                 winreg.DeleteKey(winreg.HKEY_CURRENT_USER, f"{self.reg_path}\\command")
@@ -134,6 +2772,8 @@ class InstallerUninstaller:
     def _add_to_windows_context_menu(self):
 
         if platform.system() == "Windows":
+            import winreg
+
             try:
                 print("Adding application to context menu registry keys...")
                 reg_key = winreg.CreateKey(winreg.HKEY_CURRENT_USER, self.reg_path)
@@ -167,6 +2807,8 @@ class InstallerUninstaller:
 
     def _add_to_linux_path(self):
 
+        from re import compile as re_compile
+
         print("Adding application to $PATH...")
         bash_files_and_dirs = [
             f"{self.home_dir}/.bashrc",
@@ -236,6 +2878,9 @@ class InstallerUninstaller:
 
     def _remove_from_linux_path(self):
 
+        from re import MULTILINE as re_MULTILINE
+        from re import compile as re_compile
+
         try:
             print("Removing application from $PATH...")
             with open(
@@ -332,6 +2977,83 @@ class InstallerUninstaller:
         return True
 
 
+def _parse_widths(value):
+    """Argument type of --width, single width or comma separated list"""
+
+    try:
+        widths = [int(width) for width in value.split(",")]
+    except ValueError as exc:
+        raise argparse.ArgumentTypeError(f"invalid width list: {value!r}") from exc
+    if any(width < 1 for width in widths):
+        raise argparse.ArgumentTypeError("widths must be positive")
+    return widths
+
+
+def load_presets(presets_file):
+    """Read renditions from JSON file mapping output folder names to widths
+
+    Example: {"large": 1920, "medium": 1280, "small": 640, "thumb": 320}
+    """
+
+    try:
+        with open(presets_file, "r", encoding="utf-8") as f:
+            presets = json.load(f)
+    except (IOError, ValueError) as exc:
+        raise IOError(f"Error: unable to read presets file {presets_file}!") from exc
+    if (
+        not isinstance(presets, dict)
+        or not presets
+        or not all(isinstance(w, int) and w > 0 for w in presets.values())
+    ):
+        raise ValueError("Error: presets file must map folder names to widths!")
+    return presets
+
+
+def _list_path(path):
+    """Path relative to current folder, or absolute if it is outside of it"""
+
+    try:
+        rel_path = os_path.relpath(path)
+    except ValueError:
+        # Other drive on Windows
+        return os_path.abspath(path)
+    if rel_path == os_pardir or rel_path.startswith(os_pardir + os_sep):
+        return os_path.abspath(path)
+    return rel_path
+
+
+def load_file_list(list_file):
+    """Read images to be processed from file, - for standard input
+
+    Entries are separated by new lines, or by NUL characters if there are any
+    (e.g. output of find -print0). Path can be followed by tab and width of
+    image. Returns paths mapped to widths, None if width is not given.
+    """
+
+    try:
+        if list_file == "-":
+            content = sys.stdin.buffer.read()
+        else:
+            with open(list_file, "rb") as f:
+                content = f.read()
+    except IOError as exc:
+        raise IOError(f"Error: unable to read file list {list_file}!") from exc
+    content = os_fsdecode(content)
+    files = {}
+    for line in content.split("\0" if "\0" in content else "\n"):
+        line = line.rstrip("\r\n")
+        if not line:
+            continue
+        path, tab, width = line.rpartition("\t")
+        if not tab:
+            path, width = line, None
+        elif not width.isdigit() or int(width) < 1:
+            raise ValueError(f"Error: invalid width in file list entry {line!r}!")
+        # Path listed twice is resized once, with the last width
+        files[_list_path(path)] = width and int(width)
+    return files
+
+
 def main():
 
     sys.stdout.reconfigure(encoding=InstallerUninstaller.textEncoding)
@@ -340,15 +3062,6 @@ def main():
     desc = f"{app_name} 2.1.0. Script to quickly resize images."
     parser = argparse.ArgumentParser(prog=script, description=desc)
 
-    print(
-        """\n
-        ┌─┐┬ ┬┬─┐┌─┐┌─┐┬┌─┐┌─┐┬─┐
-        ├─┘└┬┘├┬┘├┤ └─┐│┌─┘├┤ ├┬┘
-        ┴   ┴ ┴└─└─┘└─┘┴└─┘└─┘┴└─
-        \nType -h or --help to see more information.
-        """
-    )
-
     parser.add_argument(
         "-i",
         "--install",
@@ -364,11 +3077,277 @@ def main():
     parser.add_argument(
         "-x",
         "--width",
-        help="New image width (height will be adjusted automatically to keep aspect ration)",
+        help="New image width (height will be adjusted automatically to keep aspect ration). "
+        + "Comma separated list of widths creates all sizes in folders named after them, "
+        + "originals are left untouched",
+        type=_parse_widths,
+        default=[1920],
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        help="Folder for resized images, originals are left untouched "
+        + "and no backup is made",
+    )
+    parser.add_argument(
+        "--presets",
+        help="JSON file mapping output folder names to widths, "
+        + 'e.g. {"large": 1920, "thumb": 320}',
+    )
+    parser.add_argument(
+        "--format",
+        help="Convert resized images to other format, "
+        + "requires -o/--output or several widths",
+        choices=["webp", "avif"],
+    )
+    parser.add_argument(
+        "--quality",
+        help="Quality of JPEG, WebP and AVIF images, from 1 to 100 "
+        + "(lower gives smaller files)",
+        type=int,
+    )
+    parser.add_argument(
+        "--optimize",
+        help="Smaller JPEG and PNG files at the cost of longer encoding",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--progressive",
+        help="Save JPEG images as progressive (usually smaller too)",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--subsampling",
+        help="Chroma subsampling of JPEG images (4:2:0 gives smallest files)",
+        choices=["4:4:4", "4:2:2", "4:2:0"],
+    )
+    parser.add_argument(
+        "--png-compress-level",
+        help="Compression level of PNG images, from 0 (fastest) to 9 (smallest)",
+        type=int,
+        choices=range(10),
+        metavar="{0-9}",
+    )
+    parser.add_argument(
+        "--filter",
+        help="Resampling filter, from the sharpest and slowest (default: lanczos). "
+        + "For small thumbnails faster ones look the same",
+        choices=PillowEngine.FILTERS,
+    )
+    parser.add_argument(
+        "--reducing-gap",
+        help="Reduce image by integer factor first, so that it stays given times "
+        + "larger than target, then resample (at least 1, default: 2 for "
+        + "Pillow's thumbnail). Smaller is faster, larger is closer to exact",
+        type=float,
+    )
+    parser.add_argument(
+        "--engine",
+        help="Resampling engine, opencv requires opencv-python and numpy packages "
+        + "(default: pillow)",
+        choices=list(RESAMPLE_ENGINES),
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        help="Number of images resized in parallel (default: number of CPUs)",
+        type=int,
+        default=os_cpu_count() or 1,
+    )
+    parser.add_argument(
+        "--fast",
+        help="Faster, less memory consuming decoding of JPEG images "
+        + "(output is visually equivalent)",
+        action="store_true",
+    )
+    parser.add_argument(
+        "-r",
+        "--recursive",
+        help="Process images in subfolders too (backup folders are skipped)",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--files",
+        help="File with list of images to process instead of scanning folder, "
+        + "- for standard input. Entries separated by new lines or NUL characters, "
+        + "path may be followed by tab and width of image",
+    )
+    parser.add_argument(
+        "--dedup",
+        help="Resize only one of images with the same content, others get copies "
+        + "(or hard links in output folder) of its outputs. exact: identical files, "
+        + "perceptual: also images looking the same, e.g. saved again",
+        choices=["exact", "perceptual"],
+    )
+    parser.add_argument(
+        "--cache",
+        help="Keep resized images in cache shared by runs in all folders, images "
+        + "resized before with the same settings are copied from it",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        help="Folder of cache (default: pyresizer folder in user cache folder)",
+    )
+    parser.add_argument(
+        "--cache-size",
+        help="Maximum size of cache in MB, least recently used images are "
+        + "removed (default: 1024)",
+        type=int,
+        default=CACHE_BYTES // 1024**2,
+    )
+    parser.add_argument(
+        "--cache-stats",
+        help="Print number and size of cached images and exit",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--cache-prune",
+        help="Remove least recently used images over --cache-size from cache and exit",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--resume",
+        help="Continue interrupted run with its original parameters",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--inflight",
+        help="Maximum number of images kept in memory at once "
+        + "(default: two per job)",
+        type=int,
+    )
+    parser.add_argument(
+        "--memory-budget",
+        help="Approximate memory in MB used by images in flight, "
+        + "estimated from their dimensions (default: not limited)",
+        type=int,
+    )
+    parser.add_argument(
+        "--watch",
+        help="Keep running and resize new or changed images, "
+        + "once they are fully written",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--interval",
+        help="Seconds between checks of folder in --watch mode, image is resized "
+        + "when it is not modified for the same time (default: 2)",
+        type=float,
+        default=2.0,
+    )
+    parser.add_argument(
+        "--report",
+        help="Write timings of stages (scan, backup, read, decode, encode, write) "
+        + "to JSON file with totals and slowest images, or to CSV file "
+        + "with row per image",
+    )
+    parser.add_argument(
+        "--profile",
+        help="Write cProfile statistics of run to file (use -j 1 to include "
+        + "resizing, which runs in main thread then), see python -m pstats",
+    )
+    parser.add_argument(
+        "-q",
+        "--quiet",
+        help="Print only progress, errors and summary instead of line per image",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--non-interactive",
+        help="Never wait for user, e.g. for ENTER key at the end",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--log",
+        help="Append messages as JSON lines to file, - for standard output "
+        + "(instead of console messages, implies --non-interactive)",
+    )
+    parser.add_argument(
+        "--progress-interval",
+        help="Milliseconds between updates of progress in quiet mode (default: 500)",
+        type=int,
+        default=500,
+    )
+    parser.add_argument(
+        "--serve",
+        help="Run as HTTP service: POST image to /resize?width=N[&format=webp], "
+        + "GET /health for its state",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--host",
+        help="Address of HTTP service (default: 127.0.0.1)",
+        default="127.0.0.1",
+    )
+    parser.add_argument(
+        "--port", help="Port of HTTP service (default: 8080)", type=int, default=8080
+    )
+    parser.add_argument(
+        "--max-pending",
+        help="Requests of HTTP service waiting or being resized at once, "
+        + "others are rejected with 503 (default: four per job)",
         type=int,
-        default=1920,
+    )
+    parser.add_argument(
+        "--timeout",
+        help="Seconds to process request of HTTP service (default: 30)",
+        type=float,
+        default=30,
     )
     args = parser.parse_args()
+    if not (args.quiet or args.log == "-"):
+        print(
+            """\n
+        ┌─┐┬ ┬┬─┐┌─┐┌─┐┬┌─┐┌─┐┬─┐
+        ├─┘└┬┘├┬┘├┤ └─┐│┌─┘├┤ ├┬┘
+        ┴   ┴ ┴└─└─┘└─┘┴└─┘└─┘┴└─
+        \nType -h or --help to see more information.
+        """
+        )
+    if args.jobs < 1:
+        parser.error("argument -j/--jobs: must be at least 1")
+    if args.inflight is not None and args.inflight < 1:
+        parser.error("argument --inflight: must be at least 1")
+    if args.interval <= 0:
+        parser.error("argument --interval: must be greater than 0")
+    if args.memory_budget is not None and args.memory_budget < 1:
+        parser.error("argument --memory-budget: must be at least 1")
+    if args.quality is not None and not 1 <= args.quality <= 100:
+        parser.error("argument --quality: must be from 1 to 100")
+    if args.format and not (
+        args.serve or args.output or args.presets or len(args.width) > 1
+    ):
+        # Originals replaced by files with other extension would not be found again
+        parser.error(
+            "argument --format: requires -o/--output, several widths or --serve"
+        )
+    if args.reducing_gap is not None and args.reducing_gap < 1:
+        parser.error("argument --reducing-gap: must be at least 1")
+    resampling = None
+    if args.filter or args.reducing_gap or args.engine:
+        resampling = {
+            "engine": args.engine or "pillow",
+            "filter": args.filter or "lanczos",
+            "reducing_gap": args.reducing_gap,
+        }
+        engine = resample_engine(resampling)
+        if not engine.available():
+            parser.error(f"argument --engine: {args.engine} is not installed")
+        if engine.resample_filter not in engine.FILTERS:
+            parser.error(f"argument --filter: not supported by {args.engine}")
+    if args.cache_size < 0:
+        parser.error("argument --cache-size: must not be negative")
+    cache = None
+    if args.cache or args.cache_dir or args.cache_stats or args.cache_prune:
+        cache = ResizeCache(args.cache_dir, args.cache_size * 1024**2)
+    if args.files and (args.watch or args.recursive or args.serve):
+        parser.error(
+            "argument --files: not allowed with --watch, -r/--recursive or --serve"
+        )
+    out_format = args.format.upper() if args.format else None
+    if out_format and out_format not in pil_registered_extensions().values():
+        parser.error(f"argument --format: {args.format} is not supported by Pillow")
     if args.install:
         print("Installing pyresizer...")
         installer = InstallerUninstaller(app_name)
@@ -377,11 +3356,115 @@ def main():
         print("Uninstalling pyresizer...")
         uninstaller = InstallerUninstaller(app_name)
         uninstaller.remove_file()
+    elif args.cache_stats:
+        stats = cache.stats()
+        print(
+            f"Cache {stats['folder']}: {stats['images']} images, "
+            + f"{stats['bytes'] / 1024**2:.1f} MB of {stats['max_bytes'] / 1024**2:.0f} MB."
+        )
+    elif args.cache_prune:
+        removed = cache.prune()
+        print(f"{removed} images removed from cache {cache.folder}.")
+    elif args.serve:
+        server = ResizeServer(
+            args.host,
+            args.port,
+            args.jobs,
+            args.max_pending,
+            args.timeout,
+            args.width[0],
+            args.fast,
+            out_format,
+            _encoder_options(
+                args.quality,
+                args.optimize,
+                args.progressive,
+                args.subsampling,
+                args.png_compress_level,
+            ),
+            resampling=resampling,
+        )
+        server.run()
     else:
-        resizer = Resizer(args.width)
-        resizer.resize_files()
-        input("Press ENTER key to exit...")
+        renditions = None
+        if args.presets:
+            renditions = load_presets(args.presets)
+        elif len(args.width) > 1:
+            renditions = {str(width): width for width in args.width}
+        new_width = max(renditions.values()) if renditions else args.width[0]
+        resizer = Resizer(
+            new_width,
+            args.jobs,
+            args.fast,
+            args.recursive,
+            args.inflight,
+            renditions,
+            args.output,
+            out_format,
+            _encoder_options(
+                args.quality,
+                args.optimize,
+                args.progressive,
+                args.subsampling,
+                args.png_compress_level,
+            ),
+            args.memory_budget and args.memory_budget * 1024**2,
+        )
+        resizer.log = RunLog(args.quiet, args.log, args.progress_interval / 1000)
+        # Standard output carries JSON lines only, prompts would break them
+        resizer.interactive = not (args.non_interactive or args.log == "-")
+        resizer.dedup = args.dedup
+        resizer.cache = cache
+        resizer.resampling = resampling
+        if args.files:
+            files = load_file_list(args.files)
+            file_widths = {path: w for path, w in files.items() if w is not None}
+            if file_widths and renditions:
+                parser.error("argument --files: widths of images require single width")
+            resizer.files = list(files)
+            resizer.file_widths = file_widths
+            if args.files == "-":
+                # Standard input is consumed, user cannot answer questions
+                resizer.interactive = False
+        if args.resume and not resizer.load_run_params():
+            resizer.log.emit(
+                "info", "resume", "No interrupted run found, starting new one."
+            )
+        if args.report:
+            resizer.report = RunReport()
+        profiler = None
+        if args.profile:
+            # Only main thread is profiled, so resizing is included with -j 1
+            from cProfile import Profile as cprofile_Profile
+
+            profiler = cprofile_Profile()
+            profiler.enable()
+        try:
+            if args.watch:
+                resizer.watch(args.interval)
+            else:
+                resizer.resize_files()
+        finally:
+            if profiler is not None:
+                profiler.disable()
+                profiler.dump_stats(args.profile)
+                resizer.log.emit(
+                    "summary", "profile", f"Profile written to {args.profile}."
+                )
+            if resizer.report is not None:
+                resizer.report.save(args.report)
+                resizer.log.emit(
+                    "summary", "report", f"Report written to {args.report}."
+                )
+            resizer.log.close()
+        if resizer.interactive and not args.watch:
+            input("Press ENTER key to exit...")
 
 
 if __name__ == "__main__":
+    # Required by process pool in PyInstaller bundle, workers are not forked
+    if getattr(sys, "frozen", False):
+        from multiprocessing import freeze_support as mp_freeze_support
+
+        mp_freeze_support()
     main()
@@ -0,0 +1,571 @@
+"""Performance benchmarks of pyresizer.
+
+Usage:
+    python tests/benchmarks.py fast [--runs 5]
+    python tests/benchmarks.py encode [--runs 3]
+    python tests/benchmarks.py large [--src-width 12000]
+    python tests/benchmarks.py animation [--frames 300] [--frame-jobs 1,4]
+    python tests/benchmarks.py engines [--widths 1920,320] [--runs 3]
+    python tests/benchmarks.py startup [--runs 10] [--executable dist/pyresizer]
+    python tests/benchmarks.py run [--formats jpg,png] [--jobs 1,4] -o results.json
+    python tests/benchmarks.py compare baseline.json results.json [--tolerance 0.1]
+"""
+
+import argparse
+import io
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stdout
+
+# Add root directory to sys.path so we can import pyresizer
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import PIL
+from PIL import Image as PILImage
+from PIL import ImageChops, ImageStat
+
+from pyresizer import (
+    RESAMPLE_ENGINES,
+    Resizer,
+    _encode,
+    _open_resized,
+    _read_file,
+    _resize_data,
+)
+
+
+def _peak_rss_kb(children=False):
+    """Peak resident set size of current process (or its children) in KB
+
+    None if not available on platform.
+    """
+
+    try:
+        import resource  # pylint: disable=import-outside-toplevel
+    except ImportError:
+        return None
+    who = resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF
+    peak = resource.getrusage(who).ru_maxrss
+    # Value is reported in bytes on macOS and in kilobytes elsewhere
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+
+def _make_photo(path, size, seed=0):
+    """Save image with smooth gradients and noise, closer to photo than flat color
+
+    Format is chosen by file extension.
+    """
+
+    gradient = PILImage.linear_gradient("L").resize(size)
+    noise = PILImage.effect_noise((max(1, size[0] // 8), max(1, size[1] // 8)), 40)
+    noise = noise.resize(size)
+    im = PILImage.merge(
+        "RGB",
+        (
+            PILImage.blend(gradient, noise, 0.3),
+            gradient.rotate(90 + seed % 180),
+            PILImage.blend(gradient.rotate(180), noise, 0.1),
+        ),
+    )
+    if path.endswith(".gif"):
+        im = im.quantize(256)
+    if path.endswith(".jpg"):
+        im.save(path, quality=90)
+    else:
+        im.save(path)
+
+
+def _percentile(values, percent):
+    """Nearest-rank percentile, None for empty list"""
+
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, round(percent / 100 * len(ordered)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+def make_corpus(folder, img_format, count, size):
+    """Generate synthetic images, return total size of files in bytes"""
+
+    os.makedirs(folder, exist_ok=True)
+    total = 0
+    for index in range(count):
+        img = os.path.join(folder, f"img{index:05}.{img_format}")
+        _make_photo(img, size, index)
+        total += os.path.getsize(img)
+    return total
+
+
+def _measure_decode(img, new_width, fast, runs):
+    """Executed in fresh process, so peak memory is not affected by other runs"""
+
+    rss_before = _peak_rss_kb()
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        im, _ = _open_resized(img, new_width, fast)
+        timings.append(time.perf_counter() - start)
+        size = im.size
+        del im
+    rss_after = _peak_rss_kb()
+    return {
+        "size": size,
+        "best_s": min(timings),
+        "mean_s": sum(timings) / len(timings),
+        "peak_rss_delta_kb": (None if rss_before is None else rss_after - rss_before),
+    }
+
+
+def bench_fast(runs, src_size, new_width):
+    """Compare default decoding with JPEG draft mode (--fast)"""
+
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        img = os.path.join(tmp_dir, "photo.jpg")
+        _make_photo(img, src_size)
+        results = {}
+        for fast in (False, True):
+            with ProcessPoolExecutor(max_workers=1) as executor:
+                results["fast" if fast else "default"] = executor.submit(
+                    _measure_decode, img, new_width, fast, runs
+                ).result()
+    finally:
+        shutil.rmtree(tmp_dir)
+
+    print(f"Source {src_size[0]}x{src_size[1]} JPEG resized to width {new_width}:")
+    for mode, res in results.items():
+        print(
+            f"  {mode:8} output {res['size'][0]}x{res['size'][1]}, "
+            + f"best {res['best_s'] * 1000:.1f} ms, mean {res['mean_s'] * 1000:.1f} ms, "
+            + f"peak RSS delta {res['peak_rss_delta_kb']} KB"
+        )
+    return results
+
+
+# Encoder settings compared by encode benchmark: (format, save() parameters)
+ENCODE_SCENARIOS = {
+    "jpeg-default": ("JPEG", {}),
+    "jpeg-q85-optimize": ("JPEG", {"quality": 85, "optimize": True}),
+    "jpeg-q85-progressive": (
+        "JPEG",
+        {"quality": 85, "optimize": True, "progressive": True},
+    ),
+    "jpeg-q85-420": ("JPEG", {"quality": 85, "subsampling": "4:2:0"}),
+    "png-default": ("PNG", {}),
+    "png-level1": ("PNG", {"compress_level": 1}),
+    "png-level9-optimize": ("PNG", {"compress_level": 9, "optimize": True}),
+    "webp-q80": ("WEBP", {"quality": 80}),
+    "avif-q60": ("AVIF", {"quality": 60}),
+}
+
+
+def bench_encode(runs, src_size, new_width):
+    """Compare encoding time and output size of encoder settings"""
+
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        img = os.path.join(tmp_dir, "photo.png")
+        _make_photo(img, src_size)
+        im, _ = _open_resized(img, new_width)
+        im.load()
+    finally:
+        shutil.rmtree(tmp_dir)
+
+    print(f"Source {src_size[0]}x{src_size[1]} resized to width {new_width}:")
+    results = {}
+    for name, (img_format, settings) in ENCODE_SCENARIOS.items():
+        if img_format not in PILImage.registered_extensions().values():
+            print(f"  {name:22} skipped, not supported by Pillow")
+            continue
+        timings = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            data = _encode(im, img_format, {img_format: settings})
+            timings.append(time.perf_counter() - start)
+        results[name] = {"best_s": min(timings), "bytes": len(data)}
+        print(
+            f"  {name:22} best {min(timings) * 1000:7.1f} ms, "
+            + f"{len(data) / 1024:8.1f} KB"
+        )
+    return results
+
+
+def bench_engines(runs, src_size, widths):
+    """Compare speed and quality of resampling engines and filters"""
+
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        img = os.path.join(tmp_dir, "photo.png")
+        _make_photo(img, src_size)
+        with PILImage.open(img) as im:
+            src = im.convert("RGB")
+    finally:
+        shutil.rmtree(tmp_dir)
+
+    # Pillow-SIMD replaces Pillow under the same name, its version tells them apart
+    print(f"Pillow {PIL.__version__}, source {src_size[0]}x{src_size[1]}:")
+    megapixels = len(widths) * src_size[0] * src_size[1] / 1e6
+    results = {}
+    baseline = {}
+    for name, engine_class in RESAMPLE_ENGINES.items():
+        if not engine_class.available():
+            print(f"  {name:8} skipped, not installed")
+            continue
+        for resample_filter in engine_class.FILTERS:
+            for reducing_gap in [None, 1.0, 3.0]:
+                engine = engine_class(resample_filter, reducing_gap)
+                timings = []
+                for _ in range(runs):
+                    start = time.perf_counter()
+                    outputs = [
+                        engine.thumbnail(src.copy(), (width, src_size[1]))
+                        for width in widths
+                    ]
+                    timings.append(time.perf_counter() - start)
+                if not baseline:
+                    # Pillow with LANCZOS filter and default reducing gap
+                    baseline = dict(zip(widths, outputs))
+                # Mean absolute difference of pixel values from baseline (0-255)
+                diff = max(
+                    sum(
+                        ImageStat.Stat(
+                            ImageChops.difference(output, baseline[width])
+                        ).mean
+                    )
+                    / 3
+                    for width, output in zip(widths, outputs)
+                )
+                key = f"{name} {resample_filter} gap={reducing_gap or 'default'}"
+                results[key] = {"best_s": min(timings), "diff": diff}
+                print(
+                    f"  {key:34} best {min(timings) * 1000:7.1f} ms, "
+                    + f"{megapixels / min(timings):7.1f} MP/s, difference {diff:5.2f}"
+                )
+    return results
+
+
+def bench_animation(frames, src_size, new_width, frame_jobs_list):
+    """Compare resizing of animated GIF with frames shrunk in one or more threads"""
+
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        img = os.path.join(tmp_dir, "frame.png")
+        _make_photo(img, src_size)
+        with PILImage.open(img) as im:
+            im_frames = [
+                im.rotate(index * 360 / frames).quantize(256) for index in range(frames)
+            ]
+    finally:
+        shutil.rmtree(tmp_dir)
+    out = io.BytesIO()
+    im_frames[0].save(
+        out, format="GIF", save_all=True, append_images=im_frames[1:], duration=40
+    )
+    data = out.getvalue()
+
+    print(
+        f"{frames} frames {src_size[0]}x{src_size[1]} GIF resized to width {new_width}:"
+    )
+    results = {}
+    for frame_jobs in frame_jobs_list:
+        start = time.perf_counter()
+        outputs, _ = _resize_data("anim.gif", data, [new_width], frame_jobs=frame_jobs)
+        elapsed = time.perf_counter() - start
+        results[frame_jobs] = {"elapsed_s": elapsed, "bytes": len(outputs[0][0])}
+        print(
+            f"  {frame_jobs:2} frame jobs {elapsed * 1000:8.1f} ms, "
+            + f"{len(outputs[0][0]) / 1024:8.1f} KB"
+        )
+    return results
+
+
+def _measure_large(img, new_width, strips):
+    """Executed in fresh process, so peak memory is not affected by other runs"""
+
+    rss_before = _peak_rss_kb()
+    start = time.perf_counter()
+    # Large images are passed to workers by file name and reduced strip by strip
+    outputs, _ = _resize_data(img, img if strips else _read_file(img), [new_width])
+    elapsed = time.perf_counter() - start
+    rss_after = _peak_rss_kb()
+    return {
+        "size": outputs[0][1],
+        "elapsed_s": elapsed,
+        "peak_rss_delta_kb": (None if rss_before is None else rss_after - rss_before),
+    }
+
+
+def bench_large(src_size, new_width):
+    """Compare memory usage of resizing large BMP at once and strip by strip"""
+
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        img = os.path.join(tmp_dir, "scan.bmp")
+        PILImage.MAX_IMAGE_PIXELS = None
+        PILImage.linear_gradient("L").resize(src_size).convert("RGB").save(img)
+        results = {}
+        for strips in (False, True):
+            with ProcessPoolExecutor(max_workers=1) as executor:
+                results["strips" if strips else "at-once"] = executor.submit(
+                    _measure_large, img, new_width, strips
+                ).result()
+    finally:
+        shutil.rmtree(tmp_dir)
+
+    print(f"Source {src_size[0]}x{src_size[1]} BMP resized to width {new_width}:")
+    for mode, res in results.items():
+        print(
+            f"  {mode:8} output {res['size'][0]}x{res['size'][1]}, "
+            + f"{res['elapsed_s'] * 1000:.1f} ms, "
+            + f"peak RSS delta {res['peak_rss_delta_kb']} KB"
+        )
+    return results
+
+
+def bench_startup(runs, count, executable):
+    """Measure wall time of --help and of resizing small batch in new process"""
+
+    command = (
+        [executable]
+        if executable
+        else [
+            sys.executable,
+            os.path.join(os.path.dirname(__file__), "..", "pyresizer.py"),
+        ]
+    )
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        corpus = os.path.join(tmp_dir, "corpus")
+        make_corpus(corpus, "jpg", count, (800, 600))
+        scenarios = {
+            "help": ["--help"],
+            "batch": ["-x", "320", "-q", "--non-interactive", "-o", "out"],
+        }
+        results = {}
+        for name, args in scenarios.items():
+            times = []
+            for _ in range(runs):
+                # Output is removed, so manifest does not skip resized images
+                shutil.rmtree(os.path.join(corpus, "out"), ignore_errors=True)
+                start = time.perf_counter()
+                subprocess.run(
+                    command + args, cwd=corpus, check=True, stdout=subprocess.DEVNULL
+                )
+                times.append(time.perf_counter() - start)
+            results[name] = {
+                "min_s": min(times),
+                "p50_s": _percentile(times, 50),
+            }
+    finally:
+        shutil.rmtree(tmp_dir)
+
+    print(f"Startup of {' '.join(command)} ({runs} runs, batch of {count} JPEG):")
+    for name, res in results.items():
+        print(
+            f"  {name:6} min {res['min_s'] * 1000:.1f} ms, "
+            + f"median {res['p50_s'] * 1000:.1f} ms"
+        )
+    return results
+
+
+def _run_scenario(corpus, work_dir, new_width, jobs, fast):
+    """Executed in fresh process, so peak memory is not affected by other runs"""
+
+    shutil.copytree(corpus, work_dir)
+    input_bytes = sum(
+        os.path.getsize(os.path.join(work_dir, f)) for f in os.listdir(work_dir)
+    )
+    os.chdir(work_dir)
+    resizer = Resizer(new_width, jobs, fast)
+    resizer.latencies = []
+    with redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        resizer.resize_files()
+        elapsed = time.perf_counter() - start
+    resized = resizer.summary["resized"]
+    return {
+        "images": resized,
+        "input_mb": input_bytes / 1024**2,
+        "elapsed_s": elapsed,
+        "images_per_s": resized / elapsed,
+        "mb_per_s": input_bytes / 1024**2 / elapsed,
+        "latency_p50_s": _percentile(resizer.latencies, 50),
+        "latency_p95_s": _percentile(resizer.latencies, 95),
+        "peak_rss_kb": _peak_rss_kb(),
+        "peak_rss_workers_kb": _peak_rss_kb(children=True),
+    }
+
+
+def bench_run(formats, sizes, count, jobs_list, new_width, fast, output):
+    """Resize synthetic corpora with Resizer, report throughput and latency"""
+
+    results = {
+        "environment": {
+            "python": platform.python_version(),
+            "pillow": PIL.__version__,
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+        },
+        "scenarios": {},
+    }
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        for img_format in formats:
+            for size in sizes:
+                corpus = os.path.join(tmp_dir, f"{img_format}-{size[0]}x{size[1]}")
+                make_corpus(corpus, img_format, count, size)
+                for jobs in jobs_list:
+                    name = f"{img_format}-{size[0]}x{size[1]}-n{count}-j{jobs}"
+                    work_dir = os.path.join(tmp_dir, "work", name)
+                    with ProcessPoolExecutor(max_workers=1) as executor:
+                        res = executor.submit(
+                            _run_scenario, corpus, work_dir, new_width, jobs, fast
+                        ).result()
+                    shutil.rmtree(work_dir)
+                    results["scenarios"][name] = res
+                    print(
+                        f"{name:28} {res['images_per_s']:7.2f} img/s "
+                        + f"{res['mb_per_s']:7.2f} MB/s "
+                        + f"p50 {res['latency_p50_s'] * 1000:7.1f} ms "
+                        + f"p95 {res['latency_p95_s'] * 1000:7.1f} ms "
+                        + f"peak RSS {res['peak_rss_kb']} KB"
+                    )
+    finally:
+        shutil.rmtree(tmp_dir)
+
+    if output:
+        with open(output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {output}")
+    return results
+
+
+def bench_compare(baseline_file, results_file, tolerance):
+    """Compare two result files, return False if throughput regressed"""
+
+    with open(baseline_file, "r", encoding="utf-8") as f:
+        baseline = json.load(f)["scenarios"]
+    with open(results_file, "r", encoding="utf-8") as f:
+        results = json.load(f)["scenarios"]
+    passed = True
+    for name, res in results.items():
+        if name not in baseline:
+            continue
+        ratio = res["images_per_s"] / baseline[name]["images_per_s"]
+        regressed = ratio < 1 - tolerance
+        passed = passed and not regressed
+        print(
+            f"{name:28} {ratio:6.2f}x img/s, p95 "
+            + f"{baseline[name]['latency_p95_s'] * 1000:.1f} -> "
+            + f"{res['latency_p95_s'] * 1000:.1f} ms"
+            + (" REGRESSION" if regressed else "")
+        )
+    return passed
+
+
+def _dims(value):
+    width, height = value.lower().split("x")
+    return int(width), int(height)
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="pyresizer benchmarks")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+    fast_parser = subparsers.add_parser("fast", help=bench_fast.__doc__)
+    fast_parser.add_argument("--runs", type=int, default=5)
+    fast_parser.add_argument("--width", type=int, default=1920)
+    fast_parser.add_argument("--src-width", type=int, default=6000)
+    fast_parser.add_argument("--src-height", type=int, default=4000)
+    encode_parser = subparsers.add_parser("encode", help=bench_encode.__doc__)
+    encode_parser.add_argument("--runs", type=int, default=3)
+    encode_parser.add_argument("--width", type=int, default=1920)
+    encode_parser.add_argument("--src-width", type=int, default=6000)
+    encode_parser.add_argument("--src-height", type=int, default=4000)
+    large_parser = subparsers.add_parser("large", help=bench_large.__doc__)
+    large_parser.add_argument("--width", type=int, default=1920)
+    large_parser.add_argument("--src-width", type=int, default=12000)
+    large_parser.add_argument("--src-height", type=int, default=7000)
+    startup_parser = subparsers.add_parser("startup", help=bench_startup.__doc__)
+    startup_parser.add_argument("--runs", type=int, default=10)
+    startup_parser.add_argument("--count", type=int, default=5)
+    startup_parser.add_argument(
+        "--executable", help="Frozen executable, by default script is run by Python"
+    )
+    engines_parser = subparsers.add_parser("engines", help=bench_engines.__doc__)
+    engines_parser.add_argument("--runs", type=int, default=3)
+    engines_parser.add_argument("--widths", default="1920,320")
+    engines_parser.add_argument("--src-width", type=int, default=6000)
+    engines_parser.add_argument("--src-height", type=int, default=4000)
+    animation_parser = subparsers.add_parser("animation", help=bench_animation.__doc__)
+    animation_parser.add_argument("--frames", type=int, default=100)
+    animation_parser.add_argument("--width", type=int, default=320)
+    animation_parser.add_argument("--src-width", type=int, default=800)
+    animation_parser.add_argument("--src-height", type=int, default=600)
+    animation_parser.add_argument("--frame-jobs", default=f"1,{os.cpu_count() or 1}")
+    run_parser = subparsers.add_parser("run", help=bench_run.__doc__)
+    run_parser.add_argument("--formats", default="jpg,png,gif,bmp")
+    run_parser.add_argument("--sizes", default="1920x1080,3840x2160")
+    run_parser.add_argument("--count", type=int, default=20)
+    run_parser.add_argument("--jobs", default=f"1,{os.cpu_count() or 1}")
+    run_parser.add_argument("--width", type=int, default=1280)
+    run_parser.add_argument("--fast", action="store_true")
+    run_parser.add_argument("-o", "--output", help="JSON file for results")
+    compare_parser = subparsers.add_parser("compare", help=bench_compare.__doc__)
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("results")
+    compare_parser.add_argument(
+        "--tolerance", type=float, default=0.1, help="Allowed throughput drop"
+    )
+    args = parser.parse_args()
+
+    if args.benchmark == "run" and any(
+        _dims(size)[0] <= args.width for size in args.sizes.split(",")
+    ):
+        # Such images are skipped by Resizer, nothing would be measured
+        parser.error("all --sizes must be wider than --width")
+    if args.benchmark == "fast":
+        bench_fast(args.runs, (args.src_width, args.src_height), args.width)
+    elif args.benchmark == "encode":
+        bench_encode(args.runs, (args.src_width, args.src_height), args.width)
+    elif args.benchmark == "large":
+        bench_large((args.src_width, args.src_height), args.width)
+    elif args.benchmark == "engines":
+        bench_engines(
+            args.runs,
+            (args.src_width, args.src_height),
+            [int(width) for width in args.widths.split(",")],
+        )
+    elif args.benchmark == "animation":
+        bench_animation(
+            args.frames,
+            (args.src_width, args.src_height),
+            args.width,
+            sorted({int(jobs) for jobs in args.frame_jobs.split(",")}),
+        )
+    elif args.benchmark == "startup":
+        bench_startup(args.runs, args.count, args.executable)
+    elif args.benchmark == "run":
+        bench_run(
+            args.formats.split(","),
+            [_dims(size) for size in args.sizes.split(",")],
+            args.count,
+            sorted({int(jobs) for jobs in args.jobs.split(",")}),
+            args.width,
+            args.fast,
+            args.output,
+        )
+    elif args.benchmark == "compare":
+        sys.exit(0 if bench_compare(args.baseline, args.results, args.tolerance) else 1)
+
+
+if __name__ == "__main__":
+    main()
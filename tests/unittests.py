@@ -1,26 +1,73 @@
+import argparse
+import asyncio
+import csv
+import http.client
+import io
+import json
 import os
+import platform
+import random
+import shutil
+import subprocess
 import sys
+import tempfile
+import threading
+import time
 import unittest
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import redirect_stdout
 from unittest.mock import MagicMock, patch
 
+from PIL import Image as PILImage
+
 # Add root directory to sys.path so we can import pyresizer
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 
-from pyresizer import InstallerUninstaller, Resizer
+import pyresizer
+from pyresizer import InstallerUninstaller, Resizer, _reflink
 
 # Unit tests generated with support of DeepSeek AI
 
 
+def mock_scandir_entries(mock_scandir, names, dirs=()):
+    """Make mocked os.scandir return DirEntry-like objects"""
+
+    entries = []
+    for name in names:
+        entry = MagicMock()
+        entry.name = name
+        entry.path = os.path.join(".", name)
+        entry.is_file.return_value = name not in dirs
+        entry.is_dir.return_value = name in dirs
+        entries.append(entry)
+    mock_scandir.return_value.__enter__.return_value = iter(entries)
+    return entries
+
+
 class TestResizer(unittest.TestCase):
 
     def setUp(self):
         # Setup code that runs before each test
         self.new_width = 640
         self.resizer = Resizer(self.new_width)
+        # Files written by tool (e.g. manifest) land in temporary directory
+        self.old_cwd = os.getcwd()
+        self.tmp_dir = tempfile.mkdtemp()
+        os.chdir(self.tmp_dir)
+        # Images from mocked listings do not exist, so they cannot be hashed
+        patch("pyresizer._file_hash", return_value="0" * 64).start()
+        patch("pyresizer.Resizer._journal_move").start()
+        self.mock_read_file = patch(
+            "pyresizer._read_file", return_value=b"data"
+        ).start()
+        # Copy-on-write clones are not supported by mocked file system
+        patch("pyresizer._reflink", return_value=False).start()
 
     def tearDown(self):
         # Stop all patches after each test
         patch.stopall()
+        os.chdir(self.old_cwd)
+        shutil.rmtree(self.tmp_dir)
 
     def test_initialization(self):
         self.assertEqual(self.resizer.new_width, self.new_width)
@@ -33,29 +80,43 @@ class TestResizer(unittest.TestCase):
         with self.assertRaises(TypeError):
             Resizer()
 
-    @patch("pyresizer.os_listdir")
-    @patch("pyresizer.os_path.isfile")
-    def test_get_imgs(self, mock_isfile, mock_listdir):
-        mock_listdir.return_value = [
-            "test.bmp",
-            "test.gif",
-            "test.jpg",
-            "test.txt",
-            "test.png",
-        ]
-        # Simulate that all files are valid files
-        mock_isfile.side_effect = lambda x: True
+    @patch("pyresizer.os_scandir")
+    def test_get_imgs(self, mock_scandir):
+        mock_scandir_entries(
+            mock_scandir,
+            [
+                "test.bmp",
+                "test.gif",
+                "test.jpg",
+                "test.txt",
+                "TEST.PNG",
+                "test.png.txt",
+                "folder.jpg",
+            ],
+            # Directory with image-like name
+            dirs=["folder.jpg"],
+        )
 
         imgs = self.resizer.get_imgs
 
-        self.assertEqual(imgs, ["test.bmp", "test.gif", "test.jpg", "test.png"])
+        self.assertEqual(imgs, ["test.bmp", "test.gif", "test.jpg", "TEST.PNG"])
 
-    @patch("pyresizer.os_listdir")
-    @patch("pyresizer.os_path.isfile")
-    def test_get_imgs_no_images(self, mock_isfile, mock_listdir):
+    @patch("pyresizer.os_scandir")
+    def test_get_imgs_listed_once(self, mock_scandir):
+        mock_scandir_entries(mock_scandir, ["test.jpg", "test.png"])
 
-        mock_listdir.return_value = ["test.txt", "test.doc", "test.pdf"]
-        mock_isfile.side_effect = lambda x: True
+        scanner = self.resizer.scan_imgs()
+        # Lazy iterator, listing is not completed yet
+        self.assertEqual(next(iter(scanner)).name, "test.jpg")
+        self.assertEqual(self.resizer.get_imgs, ["test.jpg", "test.png"])
+        self.assertEqual(self.resizer.get_imgs, ["test.jpg", "test.png"])
+
+        mock_scandir.assert_called_once_with(".")
+
+    @patch("pyresizer.os_scandir")
+    def test_get_imgs_no_images(self, mock_scandir):
+
+        mock_scandir_entries(mock_scandir, ["test.txt", "test.doc", "test.pdf"])
 
         imgs = self.resizer.get_imgs
 
@@ -64,14 +125,14 @@ class TestResizer(unittest.TestCase):
     @patch("pyresizer.os_path.exists")
     @patch("pyresizer.os_mkdir")
     @patch("pyresizer.shutil_copy2")
-    @patch("pyresizer.os_listdir")
-    @patch("pyresizer.os_path.isfile")
+    @patch("pyresizer.os_scandir")
     def test_make_backups_success(
-        self, mock_isfile, mock_listdir, mock_copy2, mock_mkdir, mock_exists
+        self, mock_scandir, mock_copy2, mock_mkdir, mock_exists
     ):
 
-        mock_listdir.return_value = ["test.bmp", "test.gif", "test.jpg", "test.png"]
-        mock_isfile.side_effect = lambda x: True
+        mock_scandir_entries(
+            mock_scandir, ["test.bmp", "test.gif", "test.jpg", "test.png"]
+        )
         mock_exists.return_value = False
 
         result = self.resizer.make_backups()
@@ -86,14 +147,14 @@ class TestResizer(unittest.TestCase):
     @patch("pyresizer.os_path.exists")
     @patch("pyresizer.os_mkdir")
     @patch("pyresizer.shutil_copy2")
-    @patch("pyresizer.os_listdir")
-    @patch("pyresizer.os_path.isfile")
+    @patch("pyresizer.os_scandir")
     @patch("builtins.input", lambda *args: "n")
     def test_make_backups_failure(
-        self, mock_isfile, mock_listdir, mock_copy2, mock_mkdir, mock_exists
+        self, mock_scandir, mock_copy2, mock_mkdir, mock_exists
     ):
-        mock_listdir.return_value = ["test.bmp", "test.gif", "test.jpg", "test.png"]
-        mock_isfile.side_effect = lambda x: True
+        mock_scandir_entries(
+            mock_scandir, ["test.bmp", "test.gif", "test.jpg", "test.png"]
+        )
         # Simulate that the backup folder does not exist initially
         mock_exists.return_value = False
         # Simulate an IOError during the backup process
@@ -105,24 +166,37 @@ class TestResizer(unittest.TestCase):
 
         self.assertFalse(result)
 
-    @patch("pyresizer.os_listdir")
-    @patch("pyresizer.os_path.isfile")
-    @patch("pyresizer.pil_open")
+    @patch("pyresizer.os_path.exists")
+    @patch("pyresizer.os_mkdir")
     @patch("pyresizer.shutil_copy2")
+    @patch("pyresizer.os_scandir")
+    @patch("builtins.input")
+    def test_make_backups_failure_non_interactive(
+        self, mock_input, mock_scandir, mock_copy2, mock_mkdir, mock_exists
+    ):
+        mock_scandir_entries(mock_scandir, ["test.jpg"])
+        mock_exists.return_value = False
+        mock_copy2.side_effect = IOError("Backup failed")
+        self.resizer.interactive = False
+
+        self.assertFalse(self.resizer.make_backups())
+        mock_input.assert_not_called()
+
+    @patch("pyresizer.os_scandir")
+    @patch("pyresizer.pil_open")
+    @patch("pyresizer.os_replace")
     @patch("pyresizer.os_path.exists")
     @patch("pyresizer.os_mkdir")
     def test_resize_files_success(
         self,
         mock_mkdir,
         mock_exists,
-        mock_copy2,
+        mock_replace,
         mock_pil_open,
-        mock_isfile,
-        mock_listdir,
+        mock_scandir,
     ):
 
-        mock_listdir.return_value = ["test.jpg", "test.png"]
-        mock_isfile.side_effect = lambda x: True
+        mock_scandir_entries(mock_scandir, ["test.jpg", "test.png"])
 
         mock_exists.return_value = False
         # Mock the PIL image object
@@ -140,7 +214,13 @@ class TestResizer(unittest.TestCase):
 
         mock_mkdir.assert_called_once_with(self.resizer.bak_folder)
 
-        self.assertEqual(mock_copy2.call_count, len(self.resizer.get_imgs))
+        # Originals are moved to backup folder and read from there
+        for img in self.resizer.get_imgs:
+            bak_img = os.path.join(self.resizer.bak_folder, img)
+            mock_replace.assert_any_call(img, bak_img)
+            self.mock_read_file.assert_any_call(bak_img)
+            # Output is saved to temporary file renamed over original name
+            mock_replace.assert_any_call(f".{img}.pyresizer-tmp", img)
         # Assert that the image was resized and saved for each image
         self.assertEqual(mock_image.thumbnail.call_count, len(self.resizer.get_imgs))
         for call in mock_image.thumbnail.call_args_list:
@@ -155,24 +235,21 @@ class TestResizer(unittest.TestCase):
 
         self.assertTrue(result)
 
-    @patch("pyresizer.os_listdir")
-    @patch("pyresizer.os_path.isfile")
+    @patch("pyresizer.os_scandir")
     @patch("pyresizer.pil_open")
-    @patch("pyresizer.shutil_copy2")
+    @patch("pyresizer.os_replace")
     @patch("pyresizer.os_path.exists")
     @patch("pyresizer.os_mkdir")
     def test_resize_files_failure(
         self,
         mock_mkdir,
         mock_exists,
-        mock_copy2,
+        mock_replace,
         mock_pil_open,
-        mock_isfile,
-        mock_listdir,
+        mock_scandir,
     ):
 
-        mock_listdir.return_value = ["test.jpg", "test.png"]
-        mock_isfile.side_effect = lambda x: True
+        mock_scandir_entries(mock_scandir, ["test.jpg", "test.png"])
         mock_exists.return_value = False
 
         mock_pil_open.side_effect = IOError("Resizing failed")
@@ -182,11 +259,1188 @@ class TestResizer(unittest.TestCase):
             self.resizer.resize_files()
 
         mock_mkdir.assert_called_once_with(self.resizer.bak_folder)
+        # Originals are moved back from backup folder
+        mock_replace.assert_any_call(os.path.join("bak", "test.jpg"), "test.jpg")
+        mock_replace.assert_any_call(os.path.join("bak", "test.png"), "test.png")
         # Assert that the correct error message was raised
         self.assertEqual(
             str(context.exception), "Error: some files were not processed!"
         )
 
+    @patch("pyresizer.os_scandir")
+    @patch("pyresizer.pil_open")
+    @patch("pyresizer.os_replace")
+    @patch("pyresizer.os_path.exists")
+    @patch("pyresizer.os_mkdir")
+    def test_resize_files_fast(
+        self,
+        mock_mkdir,
+        mock_exists,
+        mock_replace,
+        mock_pil_open,
+        mock_scandir,
+    ):
+
+        mock_scandir_entries(mock_scandir, ["test.jpg"])
+        mock_exists.return_value = False
+        mock_image = MagicMock()
+        mock_image.size = (1600, 1201)
+        mock_image.mode = "RGB"
+        mock_pil_open.return_value = mock_image
+
+        result = Resizer(self.new_width, fast=True).resize_files()
+
+        # Draft size is rounded up to never decode below target size
+        mock_image.draft.assert_called_once_with("RGB", (self.new_width, 481))
+        mock_image.thumbnail.assert_called_once()
+        self.assertTrue(result)
+
+    @patch("pyresizer.os_path.exists")
+    @patch("pyresizer.os_mkdir")
+    @patch("pyresizer.os_replace")
+    @patch("pyresizer.shutil_copy2")
+    def test_backup_img_reflink(
+        self, mock_copy2, mock_replace, mock_mkdir, mock_exists
+    ):
+
+        mock_exists.return_value = True
+        with patch("pyresizer._reflink", return_value=True) as mock_reflink:
+            src = self.resizer._backup_img("test.jpg", move=True)
+        # Original stays in place, nothing is copied or moved
+        mock_reflink.assert_called_once_with(
+            "test.jpg", os.path.join("bak", "test.jpg")
+        )
+        mock_copy2.assert_not_called()
+        mock_replace.assert_not_called()
+        self.assertEqual(src, "test.jpg")
+
+    @patch("pyresizer.os_path.exists")
+    @patch("pyresizer.os_mkdir")
+    @patch("pyresizer.os_replace")
+    @patch("pyresizer.shutil_copy2")
+    def test_backup_img_cross_device(
+        self, mock_copy2, mock_replace, mock_mkdir, mock_exists
+    ):
+
+        mock_exists.return_value = True
+        mock_replace.side_effect = OSError(18, "Invalid cross-device link")
+
+        src = self.resizer._backup_img("test.jpg", move=True)
+
+        mock_copy2.assert_called_once_with("test.jpg", os.path.join("bak", "test.jpg"))
+        self.assertEqual(src, "test.jpg")
+
+    @unittest.skipUnless(platform.system() == "Linux", "FICLONE is Linux only")
+    def test_reflink_not_supported(self):
+
+        with open("src.jpg", "wb") as f:
+            f.write(b"data")
+        with patch("pyresizer.fcntl_ioctl", side_effect=OSError(95, "")):
+            self.assertFalse(_reflink("src.jpg", "dst.jpg"))
+        self.assertFalse(os.path.exists("dst.jpg"))
+
+    def test_load_manifest_missing(self):
+
+        self.assertEqual(self.resizer.load_manifest(), {})
+
+    def test_load_manifest_damaged(self):
+
+        with open(self.resizer.manifest_file, "w", encoding="utf-8") as f:
+            f.write("{not json")
+
+        self.assertEqual(self.resizer.load_manifest(), {})
+
+    @patch("pyresizer.os_stat")
+    def test_is_up_to_date(self, mock_stat):
+
+        entry = {
+            "width": self.new_width,
+            "out_hash": "0" * 64,
+            "out_size": 10,
+            "out_mtime_ns": 1,
+        }
+        mock_stat.return_value = MagicMock(st_size=10, st_mtime_ns=1)
+        self.assertTrue(self.resizer._is_up_to_date("test.jpg", entry))
+        # Different width requested
+        self.assertFalse(
+            Resizer(self.new_width + 1)._is_up_to_date("test.jpg", dict(entry))
+        )
+        # File touched, but content is the same (mocked hash)
+        mock_stat.return_value = MagicMock(st_size=10, st_mtime_ns=2)
+        self.assertTrue(self.resizer._is_up_to_date("test.jpg", entry))
+        self.assertEqual(entry["out_mtime_ns"], 2)
+        # File replaced with other content
+        mock_stat.return_value = MagicMock(st_size=11, st_mtime_ns=3)
+        self.assertFalse(self.resizer._is_up_to_date("test.jpg", entry))
+        self.assertFalse(self.resizer._is_up_to_date("test.jpg", None))
+
+
+class TestResizerFiles(unittest.TestCase):
+
+    def setUp(self):
+        # Work on real files in temporary directory, mocks are not visible
+        # inside worker processes
+        self.old_cwd = os.getcwd()
+        self.tmp_dir = tempfile.mkdtemp()
+        os.chdir(self.tmp_dir)
+        for name in ["a.png", "b.jpg", "c.bmp"]:
+            PILImage.new("RGB", (400, 300), "red").save(name)
+
+    def tearDown(self):
+        os.chdir(self.old_cwd)
+        shutil.rmtree(self.tmp_dir)
+
+    def test_resize_files_parallel(self):
+
+        result = Resizer(200, jobs=2).resize_files()
+
+        self.assertTrue(result)
+        for name in ["a.png", "b.jpg", "c.bmp"]:
+            with PILImage.open(name) as im:
+                self.assertEqual(im.size, (200, 150))
+            with PILImage.open(os.path.join("bak", name)) as im:
+                self.assertEqual(im.size, (400, 300))
+
+    def test_resize_files_fast_jpeg(self):
+
+        PILImage.new("RGB", (4000, 3000), "red").save("big.jpg")
+
+        result = Resizer(200, fast=True).resize_files()
+
+        self.assertTrue(result)
+        for name in ["big.jpg", "a.png", "b.jpg", "c.bmp"]:
+            with PILImage.open(name) as im:
+                self.assertEqual(im.size[0], 200)
+
+    def test_resize_files_rerun_skips_resized(self):
+
+        Resizer(200).resize_files()
+
+        with (
+            patch("pyresizer._resize_data") as mock_resize,
+            patch("pyresizer.shutil_copy2") as mock_copy2,
+        ):
+            result = Resizer(200).resize_files()
+        self.assertTrue(result)
+        mock_resize.assert_not_called()
+        mock_copy2.assert_not_called()
+        # Backups still contain original images
+        with PILImage.open(os.path.join("bak", "a.png")) as im:
+            self.assertEqual(im.size, (400, 300))
+
+        # Other width requested, images are processed again
+        Resizer(100).resize_files()
+        with PILImage.open("a.png") as im:
+            self.assertEqual(im.size, (100, 75))
+        # Backups are not overwritten with output of previous run
+        with PILImage.open(os.path.join("bak", "a.png")) as im:
+            self.assertEqual(im.size, (400, 300))
+
+    def test_resize_files_recursive(self):
+
+        os.makedirs(os.path.join("sub", "deep"))
+        os.makedirs("bak")
+        PILImage.new("RGB", (400, 300)).save(os.path.join("sub", "deep", "d.png"))
+        PILImage.new("RGB", (400, 300)).save(os.path.join("bak", "old.png"))
+
+        result = Resizer(200, jobs=2, recursive=True).resize_files()
+
+        self.assertTrue(result)
+        with PILImage.open(os.path.join("sub", "deep", "d.png")) as im:
+            self.assertEqual(im.size, (200, 150))
+        # Structure is mirrored in backup folder
+        with PILImage.open(os.path.join("bak", "sub", "deep", "d.png")) as im:
+            self.assertEqual(im.size, (400, 300))
+        # Backup folder itself is not processed
+        with PILImage.open(os.path.join("bak", "old.png")) as im:
+            self.assertEqual(im.size, (400, 300))
+        self.assertFalse(os.path.exists(os.path.join("bak", "bak")))
+
+    def test_resize_files_not_recursive(self):
+
+        os.makedirs("sub")
+        PILImage.new("RGB", (400, 300)).save(os.path.join("sub", "d.png"))
+
+        Resizer(200).resize_files()
+
+        with PILImage.open(os.path.join("sub", "d.png")) as im:
+            self.assertEqual(im.size, (400, 300))
+
+    def test_resize_files_interrupted_save(self):
+
+        def replace(src, dst):
+            # Process is interrupted right after temporary file is written
+            if src.endswith("pyresizer-tmp"):
+                raise KeyboardInterrupt
+            os.replace(src, dst)
+
+        with patch("pyresizer.os_replace", side_effect=replace):
+            with self.assertRaises(KeyboardInterrupt):
+                Resizer(200).resize_files()
+        # Original is put back in place and temporary file is removed
+        for name in ["a.png", "b.jpg", "c.bmp"]:
+            with PILImage.open(name) as im:
+                self.assertEqual(im.size, (400, 300))
+        self.assertEqual(
+            [f for f in os.listdir(".") if f.endswith("pyresizer-tmp")], []
+        )
+
+    def test_resize_files_rescans(self):
+
+        resizer = Resizer(200, output="out")
+        self.assertTrue(resizer.resize_files())
+        self.assertEqual(resizer.summary["resized"], 3)
+
+        # Next call of the same resizer sees new and modified images
+        PILImage.new("RGB", (400, 300)).save("d.png")
+        PILImage.new("RGB", (800, 600)).save("a.png")
+        self.assertTrue(resizer.resize_files())
+        self.assertEqual(resizer.summary["resized"], 2)
+        self.assertEqual(resizer.summary["up_to_date"], 2)
+
+    def test_resize_files_journal_before_move(self):
+
+        # Stale backups of other images with the same names
+        os.makedirs("bak")
+        for name in ["a.png", "b.jpg", "c.bmp"]:
+            PILImage.new("RGB", (10, 10)).save(os.path.join("bak", name))
+        resizer = Resizer(200)
+
+        def replace(src, dst):
+            if not dst.startswith("bak"):
+                return os.replace(src, dst)
+            # Process is killed right before first original is moved, its move
+            # is already recorded and synced
+            src_stat = os.stat(src)
+            with open(resizer.journal_file, encoding="utf-8") as f:
+                records = [json.loads(line) for line in f]
+            self.assertIn(
+                {
+                    "moved": src,
+                    "src": dst,
+                    "state": [src_stat.st_size, src_stat.st_mtime_ns],
+                },
+                records,
+            )
+            mock_fsync.assert_called()
+            raise KeyboardInterrupt
+
+        with (
+            patch("pyresizer._reflink", return_value=False),
+            patch("pyresizer.os_replace", side_effect=replace),
+            patch("pyresizer.os_fsync", wraps=os.fsync) as mock_fsync,
+        ):
+            with self.assertRaises(KeyboardInterrupt):
+                resizer.resize_files()
+
+        # Backup of other image is not moved in place of original
+        self.assertTrue(Resizer(200).resize_files())
+        for name in ["a.png", "b.jpg", "c.bmp"]:
+            with PILImage.open(name) as im:
+                self.assertEqual(im.size, (200, 150))
+            with PILImage.open(os.path.join("bak", name)) as im:
+                self.assertEqual(im.size, (400, 300))
+
+    def test_resize_files_resume(self):
+
+        resizer = Resizer(200, recursive=True)
+        # Simulate run killed after first image: its original was moved to
+        # backup and output written, but result was not recorded
+        os.makedirs("bak")
+        shutil.copy2("a.png", os.path.join("bak", "a.png"))
+        PILImage.new("RGB", (200, 150)).save("a.png")
+        # Original of second image was moved, output not written yet
+        os.replace("b.jpg", os.path.join("bak", "b.jpg"))
+        with open(resizer.journal_file, "w", encoding="utf-8") as f:
+            f.write('{"run": {"width": 100, "fast": false, "recursive": false}}\n')
+            f.write('{"moved": "a.png", "src": "bak/a.png"}\n')
+            f.write('{"moved": "b.jpg", "src": "bak/b.jpg"}\n')
+            f.write('{"done": "c.bm')
+
+        self.assertTrue(resizer.load_run_params())
+        self.assertEqual(resizer.new_width, 100)
+        self.assertFalse(resizer.recursive)
+        self.assertTrue(resizer.resize_files())
+
+        for name in ["a.png", "b.jpg", "c.bmp"]:
+            with PILImage.open(name) as im:
+                self.assertEqual(im.size, (100, 75))
+            with PILImage.open(os.path.join("bak", name)) as im:
+                self.assertEqual(im.size, (400, 300))
+        # Journal is removed after completed run
+        self.assertFalse(os.path.exists(resizer.journal_file))
+        self.assertFalse(Resizer(200).load_run_params())
+
+    def test_resize_files_resume_twice(self):
+
+        resizer = Resizer(200)
+        self.assertTrue(resizer.resize_files())
+        # Simulate run killed after all images were finished, before manifest
+        # was saved
+        manifest = resizer.load_manifest()
+        os.remove(resizer.manifest_file)
+        with open(resizer.journal_file, "w", encoding="utf-8") as f:
+            f.write('{"run": {"width": 200}}\n')
+            for name, entry in manifest.items():
+                f.write(json.dumps({"done": name, "entry": entry}) + "\n")
+
+        def killed(*_):
+            # Next run is killed when pipeline starts, manifest is already saved
+            self.assertEqual(Resizer(200).load_manifest(), manifest)
+            raise KeyboardInterrupt
+
+        with patch("pyresizer.Resizer._run_pipeline", side_effect=killed):
+            with self.assertRaises(KeyboardInterrupt):
+                Resizer(200).resize_files()
+
+    def test_resize_files_skips_small(self):
+
+        PILImage.new("RGB", (200, 100)).save("small.png")
+        small_stat = os.stat("small.png")
+
+        resizer = Resizer(200)
+        with patch("pyresizer._resize_data", wraps=pyresizer._resize_data) as mock:
+            self.assertTrue(resizer.resize_files())
+
+        # Neither resized nor backed up
+        self.assertEqual(mock.call_count, 3)
+        self.assertEqual(os.stat("small.png").st_mtime_ns, small_stat.st_mtime_ns)
+        self.assertFalse(os.path.exists(os.path.join("bak", "small.png")))
+        self.assertEqual(resizer.summary["small"], 1)
+        self.assertEqual(resizer.summary["resized"], 3)
+
+    def test_resize_files_renditions(self):
+
+        renditions = {"small": 100, "large": 300, "medium": 200}
+        resizer = Resizer(300, renditions=renditions, recursive=True)
+        with patch("pyresizer._shrink", wraps=pyresizer._shrink) as mock:
+            self.assertTrue(resizer.resize_files())
+
+        # Each source is decoded once, for the largest size
+        self.assertEqual(mock.call_count, 3)
+        for name in ["a.png", "b.jpg", "c.bmp"]:
+            # Originals are untouched and not backed up
+            with PILImage.open(name) as im:
+                self.assertEqual(im.size, (400, 300))
+            self.assertFalse(os.path.exists(os.path.join("bak", name)))
+            for folder, width in renditions.items():
+                with PILImage.open(os.path.join(folder, name)) as im:
+                    self.assertEqual(im.size, (width, width * 3 // 4))
+
+        # Output folders are not processed again, up to date sources are skipped
+        resizer = Resizer(300, renditions=renditions, recursive=True)
+        with patch("pyresizer._resize_data") as mock_resize:
+            self.assertTrue(resizer.resize_files())
+        mock_resize.assert_not_called()
+        self.assertEqual(resizer.summary["up_to_date"], 3)
+
+    def test_resize_files_output(self):
+
+        resizer = Resizer(200, recursive=True, output="out")
+        self.assertTrue(resizer.resize_files())
+
+        for name in ["a.png", "b.jpg", "c.bmp"]:
+            with PILImage.open(name) as im:
+                self.assertEqual(im.size, (400, 300))
+            with PILImage.open(os.path.join("out", name)) as im:
+                self.assertEqual(im.size, (200, 150))
+        # No backups, manifest is kept next to outputs
+        self.assertFalse(os.path.exists("bak"))
+        self.assertFalse(os.path.exists(".pyresizer-manifest.json"))
+        self.assertTrue(os.path.exists(os.path.join("out", ".pyresizer-manifest.json")))
+
+        # Output folder is not scanned, up to date sources are skipped
+        resizer = Resizer(200, recursive=True, output="out")
+        with patch("pyresizer._resize_data") as mock_resize:
+            self.assertTrue(resizer.resize_files())
+        mock_resize.assert_not_called()
+        self.assertEqual(resizer.summary["up_to_date"], 3)
+
+    def test_resize_files_list(self):
+
+        os.mkdir("sub")
+        PILImage.new("RGB", (400, 300), "red").save(os.path.join("sub", "d.jpg"))
+        resizer = Resizer(200)
+        resizer.files = ["sub/d.jpg", "a.png"]
+        resizer.file_widths = {"sub/d.jpg": 100}
+        self.assertTrue(resizer.resize_files())
+
+        with PILImage.open(os.path.join("sub", "d.jpg")) as im:
+            self.assertEqual(im.size, (100, 75))
+        with PILImage.open("a.png") as im:
+            self.assertEqual(im.size, (200, 150))
+        # Folder is not scanned
+        for name in ["b.jpg", "c.bmp"]:
+            with PILImage.open(name) as im:
+                self.assertEqual(im.size, (400, 300))
+        self.assertTrue(os.path.exists(os.path.join("bak", "sub", "d.jpg")))
+
+        # Widths of images are compared with manifest
+        with patch("pyresizer._resize_data") as mock_resize:
+            self.assertTrue(resizer.resize_files())
+        mock_resize.assert_not_called()
+        self.assertEqual(resizer.summary["up_to_date"], 2)
+
+    def test_resize_files_transcode(self):
+
+        options = pyresizer._encoder_options(quality=60)
+        resizer = Resizer(200, output="out", out_format="WEBP", save_options=options)
+        self.assertTrue(resizer.resize_files())
+
+        for name in ["a", "b", "c"]:
+            with PILImage.open(os.path.join("out", f"{name}.webp")) as im:
+                self.assertEqual(im.format, "WEBP")
+                self.assertEqual(im.size, (200, 150))
+
+        # Changed encoder settings make outputs outdated
+        resizer = Resizer(200, output="out", out_format="WEBP", save_options=options)
+        self.assertTrue(resizer.resize_files())
+        self.assertEqual(resizer.summary["up_to_date"], 3)
+        options = pyresizer._encoder_options(quality=80)
+        resizer = Resizer(200, output="out", out_format="WEBP", save_options=options)
+        self.assertTrue(resizer.resize_files())
+        self.assertEqual(resizer.summary["resized"], 3)
+
+    def test_resize_files_resampling(self):
+
+        resampling = {"engine": "pillow", "filter": "box", "reducing_gap": 3.0}
+        resizer = Resizer(200, output="out")
+        resizer.resampling = resampling
+        self.assertTrue(resizer.resize_files())
+        for name in ["a.png", "b.jpg", "c.bmp"]:
+            with PILImage.open(os.path.join("out", name)) as im:
+                self.assertEqual(im.size, (200, 150))
+
+        # Changed resampling makes outputs outdated
+        resizer = Resizer(200, output="out")
+        resizer.resampling = resampling
+        self.assertTrue(resizer.resize_files())
+        self.assertEqual(resizer.summary["up_to_date"], 3)
+        resizer = Resizer(200, output="out")
+        self.assertTrue(resizer.resize_files())
+        self.assertEqual(resizer.summary["resized"], 3)
+
+    def test_resize_files_palette(self):
+
+        PILImage.new("RGB", (400, 300), "red").convert("P").save("d.gif")
+        PILImage.new("RGB", (400, 300), "red").convert("P").save("e.bmp")
+        PILImage.new("P", (400, 300)).save("f.gif", transparency=0)
+        resizer = Resizer(200)
+        self.assertTrue(resizer.resize_files())
+
+        # Palette is kept, image is not saved in RGB
+        for name in ["d.gif", "e.bmp", "f.gif"]:
+            with PILImage.open(name) as im:
+                self.assertEqual(im.mode, "P")
+                self.assertEqual(im.size, (200, 150))
+        # Transparency is kept
+        with PILImage.open("f.gif") as im:
+            self.assertEqual(im.convert("RGBA").getpixel((0, 0))[3], 0)
+
+    def test_resize_files_animation(self):
+
+        frames = []
+        for index in range(4):
+            frame = PILImage.new("RGBA", (400, 300))
+            frame.paste(
+                (255, 60 * index, 0, 255), (index * 80, 0, index * 80 + 80, 300)
+            )
+            frames.append(frame)
+        frames[0].save(
+            "d.gif",
+            save_all=True,
+            append_images=frames[1:],
+            duration=[100, 200, 100, 300],
+            loop=2,
+            disposal=2,
+        )
+        resizer = Resizer(200, jobs=2)
+        # Frame threads of all jobs share CPUs
+        self.assertEqual(resizer.frame_jobs, max(1, (os.cpu_count() or 1) // 2))
+        # Frames in flight and all shrunk frames are counted
+        probe = pyresizer._probe_img("d.gif")
+        self.assertEqual(probe, ((400, 300), None, 4))
+        cost, _ = resizer._memory_cost("d.gif", "d.gif", *probe)
+        frames_in_flight = (resizer.frame_jobs * 2 + 1) * 400 * 300 * 4
+        self.assertGreaterEqual(cost, frames_in_flight + 4 * 200 * 150 * 4)
+        self.assertTrue(resizer.resize_files())
+
+        # All frames are resized, their timing is kept
+        with PILImage.open("d.gif") as im:
+            self.assertEqual(
+                (im.n_frames, im.size, im.info["loop"]), (4, (200, 150), 2)
+            )
+            durations = []
+            for index in range(im.n_frames):
+                im.seek(index)
+                durations.append(im.info["duration"])
+                self.assertEqual(im.disposal_method, 2)
+                # Previous frames are disposed, background stays transparent
+                frame = im.convert("RGBA")
+                self.assertEqual(frame.getpixel((index * 40 + 20, 75))[3], 255)
+                self.assertEqual(frame.getpixel((190, 75))[3], 0)
+            self.assertEqual(durations, [100, 200, 100, 300])
+
+    def test_resize_files_dedup(self):
+
+        shutil.copy("b.jpg", "d.jpg")
+        with PILImage.open("b.jpg") as im:
+            im.save("e.jpg", quality=50)
+        resizer = Resizer(200, output="out")
+        resizer.dedup = "exact"
+        with patch("pyresizer._resize_data", wraps=pyresizer._resize_data) as mock:
+            self.assertTrue(resizer.resize_files())
+        # Copy is not resized, its output is linked
+        self.assertEqual(mock.call_count, 4)
+        self.assertEqual(resizer.summary["duplicates"], 1)
+        outputs = []
+        for name in ["b.jpg", "d.jpg"]:
+            with open(os.path.join("out", name), "rb") as f:
+                outputs.append(f.read())
+        self.assertEqual(outputs[0], outputs[1])
+        manifest = resizer.load_manifest()
+        self.assertEqual(
+            sorted(entry.get("duplicate_of", "") for entry in manifest.values()),
+            [
+                "",
+                "",
+                "",
+                "",
+                "b.jpg" if "duplicate_of" in manifest["d.jpg"] else "d.jpg",
+            ],
+        )
+
+        # Image saved again with other quality looks the same
+        resizer = Resizer(200)
+        resizer.dedup = "perceptual"
+        self.assertTrue(resizer.resize_files())
+        self.assertEqual(resizer.summary["duplicates"], 2)
+        for name in ["a.png", "b.jpg", "c.bmp", "d.jpg", "e.jpg"]:
+            with PILImage.open(name) as im:
+                self.assertEqual(im.size, (200, 150))
+            self.assertTrue(os.path.exists(os.path.join("bak", name)))
+
+    def test_fingerprint_index(self):
+
+        rng = random.Random(0)
+        index = pyresizer.FingerprintIndex()
+        fingerprints = [rng.getrandbits(64) for _ in range(200)]
+        for number, fingerprint in enumerate(fingerprints):
+            index.add(fingerprint, number)
+        for number, fingerprint in enumerate(fingerprints):
+            # Bits flipped anywhere, also across bands
+            for bits in [(0,), (0, 13, 26, 39), (12, 13, 63, 62)]:
+                near = fingerprint
+                for bit in bits:
+                    near ^= 1 << bit
+                self.assertEqual(index.find(near), number)
+            far = fingerprint ^ 0b11111
+            self.assertNotEqual(index.find(far), number)
+
+    def test_resize_files_cache(self):
+
+        cache = pyresizer.ResizeCache(os.path.join(self.tmp_dir, "cache"))
+        resizer = Resizer(200, output="out")
+        resizer.cache = cache
+        with patch("pyresizer._src_hash", wraps=pyresizer._src_hash) as mock_hash:
+            self.assertTrue(resizer.resize_files())
+        # Hash of cache lookup is passed to resizing
+        self.assertEqual(mock_hash.call_count, 3)
+        self.assertEqual(resizer.summary["cached"], 0)
+        self.assertEqual(cache.stats()["images"], 3)
+
+        # Other folder, images are copied from cache without decoding
+        resizer = Resizer(200, output="other")
+        resizer.cache = cache
+        with patch("pyresizer._resize_data") as mock_resize:
+            self.assertTrue(resizer.resize_files())
+        mock_resize.assert_not_called()
+        self.assertEqual(resizer.summary["cached"], 3)
+        for name in ["a.png", "b.jpg", "c.bmp"]:
+            with open(os.path.join("out", name), "rb") as f:
+                data = f.read()
+            with open(os.path.join("other", name), "rb") as f:
+                self.assertEqual(f.read(), data)
+
+        # Other settings are not in cache
+        resizer = Resizer(100, output="small")
+        resizer.cache = cache
+        self.assertTrue(resizer.resize_files())
+        self.assertEqual(resizer.summary["cached"], 0)
+
+        # Images made in cascade are not used for images made from source
+        resizer = Resizer(300, renditions={"large": 300, "medium": 150})
+        resizer.cache = cache
+        self.assertTrue(resizer.resize_files())
+        resizer = Resizer(150, output="direct")
+        resizer.cache = cache
+        self.assertTrue(resizer.resize_files())
+        self.assertEqual(resizer.summary["cached"], 0)
+        resizer = Resizer(300, renditions={"large2": 300, "medium2": 150})
+        resizer.cache = cache
+        self.assertTrue(resizer.resize_files())
+        self.assertEqual(resizer.summary["cached"], 3)
+
+    def test_resize_cache_damaged(self):
+
+        cache = pyresizer.ResizeCache(os.path.join(self.tmp_dir, "cache"))
+        key = cache.key("0" * 64, 200, False, "PNG")
+        cache.put([key], [(b"junk", [200, 150])])
+
+        # Damaged image is a miss and is removed
+        self.assertIsNone(cache.get([key]))
+        self.assertEqual(cache.stats()["images"], 0)
+
+    def test_resize_cache_prune(self):
+
+        cache = pyresizer.ResizeCache(os.path.join(self.tmp_dir, "cache"), 250)
+        keys = [cache.key("0" * 64, width, False, "PNG") for width in [100, 200, 300]]
+        for index, key in enumerate(keys):
+            cache.put([key], [(b"x" * 100, [1, 1])])
+            os.utime(cache._path(key), (index, index))
+        # Least recently used images are removed first
+        self.assertEqual(cache.prune(), 1)
+        self.assertEqual(cache.stats()["bytes"], 200)
+        self.assertFalse(os.path.exists(cache._path(keys[0])))
+        self.assertEqual(cache.prune(0), 2)
+        self.assertEqual(cache.stats()["images"], 0)
+
+    def test_watch(self):
+
+        resizer = Resizer(200)
+
+        def sleep(_):
+            if not os.path.exists("d.png"):
+                PILImage.new("RGB", (400, 300), "red").save("d.png")
+                # Written long ago, so it is ready at once
+                os.utime("d.png", (1, 1))
+            else:
+                raise KeyboardInterrupt
+
+        with patch("pyresizer.time.sleep", side_effect=sleep):
+            resizer.watch(interval=0.01)
+
+        for name in ["a.png", "b.jpg", "c.bmp", "d.png"]:
+            with PILImage.open(name) as im:
+                self.assertEqual(im.size, (200, 150))
+        # Only new image was processed by second run, outputs of first run
+        # were not taken for changed images
+        self.assertEqual(resizer.summary["resized"], 1)
+        self.assertEqual(resizer.summary["up_to_date"], 0)
+
+    def test_folder_watcher(self):
+
+        # Folder not changed for long time
+        os.utime(".", (1, 1))
+        watcher = pyresizer.FolderWatcher(".", [".png"], settle=60)
+        with patch("pyresizer.os_scandir", wraps=os.scandir) as mock_scandir:
+            self.assertEqual(watcher.poll(), [])
+        # Existing images are not reported, unchanged folder is not listed
+        mock_scandir.assert_not_called()
+
+        PILImage.new("RGB", (400, 300), "red").save("d.png")
+        # Image is not reported until it is not modified for settle time
+        self.assertEqual(watcher.poll(), [])
+        os.utime("d.png", (1, 1))
+        self.assertEqual(watcher.poll(), [os.path.join(".", "d.png")])
+        self.assertEqual(watcher.poll(), [])
+
+        # Overwritten in place, folder is not changed
+        os.utime(".", (1, 1))
+        self.assertEqual(watcher.poll(), [])
+        PILImage.new("RGB", (200, 150), "red").save("a.png")
+        os.utime("a.png", (2, 2))
+        self.assertEqual(os.stat(".").st_mtime, 1)
+        self.assertEqual(watcher.poll(), [os.path.join(".", "a.png")])
+        self.assertEqual(watcher.poll(), [])
+
+    def test_resize_files_report(self):
+
+        resizer = Resizer(200)
+        resizer.report = pyresizer.RunReport(slowest=2)
+        resizer.resize_files()
+
+        report = resizer.report.to_dict()
+        self.assertEqual(report["resized"], 3)
+        self.assertEqual(len(report["slowest"]), 2)
+        for stage in ["scan_s", "backup_s", "read_s", "decode_resample_s", "write_s"]:
+            self.assertGreater(report["stages_s"][stage], 0)
+
+        resizer.report.save("report.csv")
+        with open("report.csv", encoding="utf-8") as f:
+            rows = list(csv.DictReader(f))
+        self.assertEqual(
+            sorted(row["image"] for row in rows), ["a.png", "b.jpg", "c.bmp"]
+        )
+        self.assertTrue(all(float(row["total_s"]) > 0 for row in rows))
+
+    def test_resize_files_quiet_log(self):
+
+        resizer = Resizer(200)
+        resizer.log = pyresizer.RunLog(quiet=True, log_file="log.jsonl")
+        with redirect_stdout(io.StringIO()) as stdout:
+            resizer.resize_files()
+        resizer.log.close()
+
+        # Only progress and summary are printed
+        self.assertNotIn("Resizing", stdout.getvalue())
+        self.assertIn("3 files resized", stdout.getvalue())
+        with open("log.jsonl", encoding="utf-8") as f:
+            records = [json.loads(line) for line in f]
+        self.assertEqual(
+            sorted(r["image"] for r in records if r["event"] == "resized"),
+            ["a.png", "b.jpg", "c.bmp"],
+        )
+        self.assertEqual(records[-1]["event"], "finished")
+
+    def test_log_stdout(self):
+
+        result = subprocess.run(
+            [sys.executable, pyresizer.__file__, "-x", "200", "-j", "1", "--log", "-"],
+            stdin=subprocess.DEVNULL,
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        # Nothing but JSON lines, user is not asked to press ENTER
+        records = [json.loads(line) for line in result.stdout.splitlines()]
+        self.assertEqual(records[-1]["event"], "finished")
+
+    def test_resize_files_parallel_fresh_process(self):
+
+        for name in ["d.png", "e.jpg"]:
+            PILImage.new("RGB", (400, 300), "red").save(name)
+        # Pillow is not imported yet, as in command line run
+        code = (
+            "import sys\n"
+            f"sys.path.insert(0, {os.path.dirname(pyresizer.__file__)!r})\n"
+            "from pyresizer import Resizer\n"
+            "assert 'PIL' not in sys.modules\n"
+            "assert Resizer(200, jobs=2).resize_files()\n"
+        )
+        # Worker waiting for lock held by other thread would never end
+        subprocess.run(
+            [sys.executable, "-c", code], check=True, timeout=60, cwd=self.tmp_dir
+        )
+        for name in ["a.png", "b.jpg", "c.bmp", "d.png", "e.jpg"]:
+            with PILImage.open(name) as im:
+                self.assertEqual(im.size, (200, 150))
+
+    def test_resize_files_latencies(self):
+
+        resizer = Resizer(200)
+        self.assertIsNone(resizer.latencies)
+        resizer.latencies = []
+
+        resizer.resize_files()
+
+        self.assertEqual(len(resizer.latencies), 3)
+        self.assertTrue(all(latency > 0 for latency in resizer.latencies))
+
+    def test_resize_files_inflight_limit(self):
+
+        counters = {"read": 0, "written": 0, "max_inflight": 0}
+        read_file = pyresizer._read_file
+        write_atomic = pyresizer._write_atomic
+
+        def read(img):
+            counters["read"] += 1
+            counters["max_inflight"] = max(
+                counters["max_inflight"], counters["read"] - counters["written"]
+            )
+            return read_file(img)
+
+        def write(data, img):
+            counters["written"] += 1
+            return write_atomic(data, img)
+
+        with (
+            patch("pyresizer._read_file", side_effect=read),
+            patch("pyresizer._write_atomic", side_effect=write),
+        ):
+            self.assertTrue(Resizer(200, inflight=2).resize_files())
+
+        self.assertEqual(counters["written"], 3)
+        self.assertLessEqual(counters["max_inflight"], 2)
+
+    def test_resize_files_memory_budget(self):
+
+        resizer = Resizer(100, memory_budget=1)
+        # Every image exceeds budget, so all are large and processed one by one
+        with patch("pyresizer._read_file") as mock_read_file:
+            self.assertTrue(resizer.resize_files())
+        mock_read_file.assert_not_called()
+        self.assertEqual(resizer._budget.used, 0)
+        for name in ["a.png", "b.jpg", "c.bmp"]:
+            with PILImage.open(name) as im:
+                self.assertEqual(im.size, (100, 75))
+
+    def test_memory_cost(self):
+
+        resizer = Resizer(100, memory_budget=1)
+        decoded = 400 * 300 * 4
+        out = 100 * 75 * 4
+        # Large PNG is decoded at once, only BMP is reduced strip by strip and
+        # JPEG scaled during decoding
+        probes = {
+            name: pyresizer._probe_img(name) for name in ["a.png", "b.jpg", "c.bmp"]
+        }
+        self.assertEqual(probes["a.png"], ((400, 300), None, 1))
+        self.assertEqual(
+            resizer._memory_cost("a.png", "a.png", *probes["a.png"]),
+            (decoded + out, True),
+        )
+        self.assertEqual(
+            resizer._memory_cost("b.jpg", "b.jpg", *probes["b.jpg"]),
+            (decoded // 16 + out, True),
+        )
+        self.assertEqual(
+            resizer._memory_cost("c.bmp", "c.bmp", *probes["c.bmp"]),
+            (decoded // 4 + pyresizer.STRIP_BYTES + out, True),
+        )
+
+    def test_reduce_strips(self):
+
+        im = PILImage.linear_gradient("L").resize((400, 300)).convert("RGB")
+        im.save("d.bmp")
+        im.convert("P").save("e.png")
+
+        # Strips much smaller than image
+        with patch("pyresizer.STRIP_BYTES", 4096):
+            with PILImage.open("d.bmp") as src:
+                reduced = pyresizer._reduce_strips(src, "d.bmp", 3)
+            with PILImage.open("e.png") as src:
+                self.assertIsNone(pyresizer._reduce_strips(src, "e.png", 3))
+
+        self.assertEqual(reduced.tobytes(), im.reduce(3).tobytes())
+
+    def test_memory_budget(self):
+
+        budget = pyresizer.MemoryBudget(10)
+        self.assertTrue(budget.acquire(6))
+        self.assertFalse(budget.acquire(6, timeout=0))
+        budget.release(6)
+        # Image larger than budget is admitted alone
+        self.assertTrue(budget.acquire(100, timeout=0))
+        self.assertFalse(budget.acquire(1, timeout=0))
+
+    def test_resize_files_parallel_failure(self):
+
+        with open("broken.jpg", "wb") as f:
+            f.write(b"not an image")
+
+        with self.assertRaises(IOError) as context:
+            Resizer(200, jobs=2).resize_files()
+
+        self.assertEqual(
+            str(context.exception), "Error: some files were not processed!"
+        )
+        # Remaining images are processed despite the failure
+        for name in ["a.png", "b.jpg", "c.bmp"]:
+            with PILImage.open(name) as im:
+                self.assertEqual(im.size, (200, 150))
+
+
+class TestApi(unittest.TestCase):
+
+    def setUp(self):
+        out = io.BytesIO()
+        PILImage.new("RGB", (400, 300), "red").save(out, format="PNG")
+        self.data = out.getvalue()
+
+    def test_resize_image(self):
+
+        for src in [self.data, bytearray(self.data), io.BytesIO(self.data)]:
+            with PILImage.open(io.BytesIO(pyresizer.resize_image(src, 200))) as im:
+                self.assertEqual((im.format, im.size), ("PNG", (200, 150)))
+
+    def test_resize_image_widths(self):
+
+        with patch("pyresizer._shrink", wraps=pyresizer._shrink) as mock_shrink:
+            results = pyresizer.resize_image(self.data, [100, 300], out_format="WEBP")
+        mock_shrink.assert_called_once()
+        # Results are in order of requested widths
+        for data, width in zip(results, [100, 300]):
+            with PILImage.open(io.BytesIO(data)) as im:
+                self.assertEqual((im.format, im.size[0]), ("WEBP", width))
+
+    def test_resize_image_resampling(self):
+
+        for resample_filter in pyresizer.PillowEngine.FILTERS:
+            for reducing_gap in [None, 1.0, 3.0]:
+                resampling = {"filter": resample_filter, "reducing_gap": reducing_gap}
+                data = pyresizer.resize_image(self.data, 100, resampling=resampling)
+                with PILImage.open(io.BytesIO(data)) as im:
+                    self.assertEqual(im.size, (100, 75))
+
+    @unittest.skipUnless(
+        pyresizer.OpenCVEngine.available(), "opencv-python is not installed"
+    )
+    def test_opencv_engine(self):
+
+        modes = {"L": "L", "RGB": "RGB", "RGBA": "RGBA", "P": "RGB", "I;16": "RGB"}
+        for resample_filter in pyresizer.OpenCVEngine.FILTERS:
+            engine = pyresizer.OpenCVEngine(resample_filter)
+            for mode, out_mode in modes.items():
+                im = PILImage.new(mode, (400, 300))
+                resized = engine.resize(im, (100, 75))
+                self.assertEqual((resized.mode, resized.size), (out_mode, (100, 75)))
+                thumb = engine.thumbnail(PILImage.new(mode, (400, 300)), (100, 76))
+                self.assertEqual((thumb.mode, thumb.size), (out_mode, (100, 75)))
+        # Whole pipeline, including JPEG draft
+        resampling = {"engine": "opencv", "filter": "lanczos", "reducing_gap": 1.5}
+        out = io.BytesIO()
+        PILImage.new("RGB", (400, 300), "red").save(out, format="JPEG")
+        data = pyresizer.resize_image(out.getvalue(), [200, 50], resampling=resampling)
+        for result, size in zip(data, [(200, 150), (50, 38)]):
+            with PILImage.open(io.BytesIO(result)) as im:
+                self.assertEqual((im.format, im.size), ("JPEG", size))
+
+    def test_fit_size(self):
+
+        # Same sizes as Pillow's thumbnail, used by engines without it
+        for size in [(400, 300), (4000, 2999), (1001, 3), (3, 1001), (1920, 1081)]:
+            for width in [1, 7, 320, 333]:
+                box = (width, max(width * size[1] / size[0], 1) + 0.7)
+                im = PILImage.new("L", size)
+                im.thumbnail(box)
+                if im.size != size:
+                    self.assertEqual(pyresizer._fit_size(size, box), im.size)
+
+    def test_resize_image_invalid(self):
+
+        with self.assertRaises(IOError):
+            pyresizer.resize_image(b"not an image", 200)
+
+    def test_resize_images(self):
+
+        for jobs in [1, 2]:
+            results = pyresizer.resize_images(
+                (self.data for _ in range(5)), 100, jobs=jobs
+            )
+            sizes = [PILImage.open(io.BytesIO(data)).size for data in results]
+            self.assertEqual(sizes, [(100, 75)] * 5)
+
+
+class TestResizeServer(unittest.TestCase):
+
+    def setUp(self):
+        out = io.BytesIO()
+        PILImage.new("RGB", (400, 300), "red").save(out, format="JPEG")
+        self.data = out.getvalue()
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+        self.server = pyresizer.ResizeServer(port=0)
+        asyncio.run_coroutine_threadsafe(self.server.start(), self.loop).result()
+
+    def tearDown(self):
+        asyncio.run_coroutine_threadsafe(self.server.stop(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+    def request(self, method, path, body=None):
+        conn = http.client.HTTPConnection("127.0.0.1", self.server.port, timeout=30)
+        try:
+            conn.request(method, path, body)
+            response = conn.getresponse()
+            return response.status, response.getheader("Content-Type"), response.read()
+        finally:
+            conn.close()
+
+    def test_health(self):
+
+        status, content_type, body = self.request("GET", "/health")
+
+        self.assertEqual((status, content_type), (200, "application/json"))
+        self.assertEqual(json.loads(body)["status"], "ok")
+
+    def test_resize(self):
+
+        status, content_type, body = self.request(
+            "POST", "/resize?width=200", self.data
+        )
+        self.assertEqual((status, content_type), (200, "image/jpeg"))
+        with PILImage.open(io.BytesIO(body)) as im:
+            self.assertEqual(im.size, (200, 150))
+
+        status, content_type, body = self.request(
+            "POST", "/resize?width=100&format=webp", self.data
+        )
+        self.assertEqual((status, content_type), (200, "image/webp"))
+        self.assertEqual(self.server.served, 2)
+
+    def test_resize_resampling(self):
+
+        self.server.resampling = {"filter": "box", "reducing_gap": 3.0}
+        self.assertEqual(self.server._resize_args({})[-1], self.server.resampling)
+        status, _, body = self.request("POST", "/resize?width=200", self.data)
+        self.assertEqual(status, 200)
+        with PILImage.open(io.BytesIO(body)) as im:
+            self.assertEqual(im.size, (200, 150))
+
+    def test_resize_invalid(self):
+
+        self.assertEqual(self.request("POST", "/resize", b"junk")[0], 400)
+        self.assertEqual(self.request("POST", "/resize?width=x", self.data)[0], 400)
+        self.assertEqual(self.request("GET", "/resize")[0], 405)
+        self.assertEqual(self.request("GET", "/missing")[0], 404)
+        # Formats Pillow can only read are rejected
+        status, _, body = self.request("POST", "/resize?format=psd", self.data)
+        self.assertEqual((status, body), (400, b"Error: format psd is not supported!"))
+
+    def test_resize_worker_error(self):
+
+        self.server._executor.shutdown()
+        self.server._executor = ThreadPoolExecutor(max_workers=1)
+        with patch("pyresizer.resize_image", side_effect=KeyError("PSD")):
+            status, _, body = self.request("POST", "/resize", self.data)
+        # Connection is not dropped without answer
+        self.assertEqual(status, 500)
+        self.assertIn(b"KeyError", body)
+
+    def test_backpressure(self):
+
+        # All places are taken, request is rejected without waiting
+        self.server.max_pending = 0
+        self.assertEqual(self.request("POST", "/resize", self.data)[0], 503)
+        # Body is not waited for either
+        self.server.timeout = 5
+        conn = http.client.HTTPConnection("127.0.0.1", self.server.port, timeout=2)
+        try:
+            conn.putrequest("POST", "/resize")
+            conn.putheader("Content-Length", str(len(self.data)))
+            conn.endheaders()
+            self.assertEqual(conn.getresponse().status, 503)
+        finally:
+            conn.close()
+
+    def test_timeout(self):
+
+        # Only job is busy, request waits for it longer than timeout
+        asyncio.run_coroutine_threadsafe(
+            self.server._slots.acquire(), self.loop
+        ).result()
+        self.server.timeout = 0.2
+        self.assertEqual(self.request("POST", "/resize", self.data)[0], 504)
+        # Place of timed out request is freed
+        self.assertEqual(self.server.pending, 0)
+
+    def test_timeout_running_job(self):
+
+        # Jobs run in thread, so that resizing can be held
+        self.server._executor.shutdown()
+        self.server._executor = ThreadPoolExecutor(1)
+        self.server.timeout = 0.5
+        finish = threading.Event()
+
+        def resize_image(*_):
+            finish.wait(10)
+            return self.data
+
+        with patch("pyresizer.resize_image", side_effect=resize_image):
+            self.assertEqual(self.request("POST", "/resize", self.data)[0], 504)
+            # Job is still running, its slot is not given to other requests
+            self.assertEqual(self.server.pending, 0)
+            self.assertTrue(self.server._slots.locked())
+            finish.set()
+            for _ in range(500):
+                if not self.server._slots.locked():
+                    break
+                time.sleep(0.01)
+        self.assertFalse(self.server._slots.locked())
+
+
+class TestArguments(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_parse_widths(self):
+
+        self.assertEqual(pyresizer._parse_widths("1920"), [1920])
+        self.assertEqual(pyresizer._parse_widths("1920,640"), [1920, 640])
+        with self.assertRaises(argparse.ArgumentTypeError):
+            pyresizer._parse_widths("1920,big")
+        with self.assertRaises(argparse.ArgumentTypeError):
+            pyresizer._parse_widths("0")
+
+    def test_encoder_options(self):
+
+        self.assertEqual(pyresizer._encoder_options(), {})
+        self.assertEqual(
+            pyresizer._encoder_options(85, optimize=True, compress_level=9),
+            {
+                "JPEG": {"quality": 85, "optimize": True},
+                "PNG": {"optimize": True, "compress_level": 9},
+                "WEBP": {"quality": 85},
+                "AVIF": {"quality": 85},
+            },
+        )
+
+    def test_load_presets(self):
+
+        presets_file = os.path.join(self.tmp_dir, "presets.json")
+        with open(presets_file, "w", encoding="utf-8") as f:
+            f.write('{"large": 1920, "thumb": 320}')
+        self.assertEqual(
+            pyresizer.load_presets(presets_file), {"large": 1920, "thumb": 320}
+        )
+
+        with open(presets_file, "w", encoding="utf-8") as f:
+            f.write('{"large": "big"}')
+        with self.assertRaises(ValueError):
+            pyresizer.load_presets(presets_file)
+
+        with self.assertRaises(IOError) as context:
+            pyresizer.load_presets(os.path.join(self.tmp_dir, "missing.json"))
+        self.assertIn("unable to read presets file", str(context.exception))
+
+    def test_load_file_list(self):
+
+        list_file = os.path.join(self.tmp_dir, "files.txt")
+        outside = os.path.abspath(os.path.join(os.sep, "data", "c.jpg"))
+        with open(list_file, "w", encoding="utf-8", newline="") as f:
+            f.write(f"a.jpg\n./sub/b.png\t640\r\n\n{outside}\na.jpg\t320\n")
+        self.assertEqual(
+            pyresizer.load_file_list(list_file),
+            {"a.jpg": 320, os.path.join("sub", "b.png"): 640, outside: None},
+        )
+
+        with open(list_file, "wb") as f:
+            f.write(b"with\nnew line.jpg\0b.jpg\0")
+        self.assertEqual(
+            list(pyresizer.load_file_list(list_file)), ["with\nnew line.jpg", "b.jpg"]
+        )
+
+        with open(list_file, "w", encoding="utf-8") as f:
+            f.write("a.jpg\tbig\n")
+        with self.assertRaises(ValueError):
+            pyresizer.load_file_list(list_file)
+
+    def test_help_lazy_imports(self):
+
+        # Fresh interpreter, modules are already imported by tests
+        code = (
+            "import sys; import pyresizer; sys.argv = ['pyresizer', '--help']\n"
+            "try:\n    pyresizer.main()\nexcept SystemExit:\n    pass\n"
+            "print(sorted({'PIL', 'asyncio', 'concurrent.futures.process'}"
+            " & set(sys.modules)), file=sys.stderr)"
+        )
+        result = subprocess.run(
+            [sys.executable, "-c", code],
+            cwd=os.path.dirname(os.path.abspath(pyresizer.__file__)),
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        self.assertIn("usage:", result.stdout)
+        self.assertEqual(result.stderr.strip(), "[]")
+
 
 class TestInstallerUninstaller(unittest.TestCase):
 